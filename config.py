@@ -1,29 +1,69 @@
 # CRM-MCP Configuration
 
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # .env ファイル読み込み
 load_dotenv()
 
-# データベース設定（.env ファイルから取得）
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "port": int(os.getenv("DB_PORT", 5432)),
-    "database": os.getenv("DB_NAME", "wealthai"),
-    "user": os.getenv("DB_USER", "wealthai_user"),
-    "password": os.getenv("DB_PASSWORD", "wealthai123")
-}
+@dataclass(frozen=True, slots=True)
+class DBConfig:
+    """データベース接続設定"""
+    host: str
+    port: int
+    database: str
+    user: str
+    password: str
+    statement_timeout: str
+    pool_min_size: int
+    pool_max_size: int
+    statement_cache_size: int
+
+@lru_cache(maxsize=1)
+def get_db_config() -> DBConfig:
+    """データベース設定（.env ファイルから取得、初回のみ生成）"""
+    return DBConfig(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", 5432)),
+        database=os.getenv("DB_NAME", "wealthai"),
+        user=os.getenv("DB_USER", "wealthai_user"),
+        password=os.getenv("DB_PASSWORD", "wealthai123"),
+        statement_timeout=os.getenv("DB_STATEMENT_TIMEOUT", "5s"),
+        pool_min_size=int(os.getenv("DB_POOL_MIN_SIZE", 5)),
+        pool_max_size=int(os.getenv("DB_POOL_MAX_SIZE", 20)),
+        # PgBouncer（transaction プーリング）経由の場合は 0 にしてプリペアドステートメントを無効化
+        statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+    )
+
+# ログレベル（.env の LOG_LEVEL、本番は INFO でデバッグ出力を抑止）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# uvicorn ワーカープロセス数（ワーカーごとにDBプールを持つため DB_POOL_MAX_SIZE はワーカーあたりの上限）
+WORKERS = int(os.getenv("WORKERS", 1))
 
 # Bedrock設定
 BEDROCK_CONFIG = {
     "region_name": "us-east-1",
-    "model_id": "anthropic.claude-3-sonnet-20240229-v1:0"
+    "model_id": "anthropic.claude-3-sonnet-20240229-v1:0",
+    # 引数標準化（定型的なJSON抽出）用の高速モデル（.env の BEDROCK_STANDARDIZE_MODEL_ID）
+    "standardize_model_id": os.getenv("BEDROCK_STANDARDIZE_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0"),
+    # 引数標準化の推論レイテンシ設定（未指定時は BEDROCK_LATENCY と同じ、.env の BEDROCK_STANDARDIZE_LATENCY）
+    "standardize_latency": os.getenv("BEDROCK_STANDARDIZE_LATENCY", os.getenv("BEDROCK_LATENCY", "standard")),
+    # system プロンプトのプロンプトキャッシュ（対応モデルのみ、.env の BEDROCK_PROMPT_CACHING）
+    "prompt_caching": os.getenv("BEDROCK_PROMPT_CACHING", "false").lower() == "true",
+    # 推論レイテンシ設定（"optimized" は対応モデル・リージョンのみ、.env の BEDROCK_LATENCY）
+    "latency": os.getenv("BEDROCK_LATENCY", "standard"),
+    # 同一リクエスト（モデル・プロンプト・パラメータ）の応答を再利用する秒数（0 で無効、.env の BEDROCK_RESPONSE_CACHE_TTL）
+    "response_cache_ttl": float(os.getenv("BEDROCK_RESPONSE_CACHE_TTL", 3600))
 }
 
 # MCP設定
 MCP_CONFIG = {
     "server_name": "CRM-MCP",
     "version": "1.0.0",
-    "protocol_version": "2024-11-05"
+    "protocol_version": "2024-11-05",
+    # debug_response に検索結果・プロンプト全文を含めるか（false なら要約のみ、リクエストの params.debug で上書き可）
+    "full_debug_response": os.getenv("MCP_FULL_DEBUG_RESPONSE", "true").lower() == "true"
 }
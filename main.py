@@ -1,16 +1,76 @@
 # CRM-MCP Main Application
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+import logging.handlers
+import queue
+from contextlib import asynccontextmanager
+import msgspec
+from fastapi import FastAPI, HTTPException, Request, Response
 from datetime import datetime
+from typing import Dict, Optional
 from models import MCPRequest, MCPResponse
 from tools_manager import ToolsManager
-from config import MCP_CONFIG
+from config import MCP_CONFIG, LOG_LEVEL, WORKERS
+from utils.database import init_db_pool, close_db_pool
+from utils.json_util import ORJSONResponse, to_flag
+from utils.http_client import close_http_client
+from utils.system_prompt import clear_system_prompt_cache
+from utils.debug_context import full_debug_var
+from tools.bond_maturity import BOND_MATURITY_WARMUP
+from tools.customer_holdings import HOLDINGS_WARMUP
 
-app = FastAPI(title="CRM-MCP Server", version=MCP_CONFIG["version"])
+def setup_logging() -> logging.handlers.QueueListener:
+    """ログ出力をキュー経由にし、バックグラウンドスレッドで書き込む（イベントループを stdout 書き込みで止めない）
+    
+    `python main.py` では uvicorn が main を再インポートするため、root に設定済みのキューハンドラーがあれば
+    そのリスナーを再利用する（リスナーの二重起動と、使われていない方を停止する誤りを防ぐ）
+    """
+    root = logging.getLogger()
+    for handler in root.handlers:
+        listener = getattr(handler, "listener", None)
+        if isinstance(handler, logging.handlers.QueueHandler) and listener is not None:
+            return listener
+    
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # メッセージ本文のみ整形してキューへ（時刻・レベル等の付与は出力側の Formatter が行う）
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    queue_handler.listener = listener
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    listener.start()
+    return listener
+
+_log_listener = setup_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時にDBコネクションプールを生成し（高頻度クエリは接続ごとに準備済み）、終了時に共有HTTPクライアントとともに破棄"""
+    await init_db_pool(warmup_queries=[BOND_MATURITY_WARMUP, HOLDINGS_WARMUP])
+    yield
+    await close_db_pool()
+    await close_http_client()
+    # 未出力のログを書き出してからリスナースレッドを停止
+    _log_listener.stop()
+
+app = FastAPI(
+    title="CRM-MCP Server",
+    version=MCP_CONFIG["version"],
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # ツール管理インスタンス
 tools_manager = ToolsManager()
 
+# MCPレスポンスのエンコーダー（Decimal は数値、未対応型は文字列として出力）
+MCP_RESPONSE_ENCODER = msgspec.json.Encoder(decimal_format="number", enc_hook=str)
+
 @app.get("/health")
 async def health_check():
     """ヘルスチェック"""
@@ -21,86 +81,173 @@ async def health_check():
     }
 
 @app.post("/mcp")
-async def mcp_endpoint(request: MCPRequest):
+async def mcp_endpoint(http_request: Request):
     """MCPプロトコルエンドポイント"""
-    print(f"[MCP_ENDPOINT] === REQUEST START ===")
-    print(f"[MCP_ENDPOINT] Request received: {request}")
-    
     try:
-        method = request.method
-        params = request.params
-        
-        if method == "initialize":
-            # 初期化
-            return MCPResponse(
-                id=request.id,
-                result={
-                    "protocolVersion": MCP_CONFIG["protocol_version"],
-                    "capabilities": {},
-                    "serverInfo": {
-                        "name": MCP_CONFIG["server_name"],
-                        "version": MCP_CONFIG["version"]
-                    }
-                }
-            )
+        request = msgspec.json.decode(await http_request.body(), type=MCPRequest)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    response = await handle_mcp_request(request)
+    # Struct を dict に変換せず msgspec で直接シリアライズ
+    return Response(content=MCP_RESPONSE_ENCODER.encode(response), media_type="application/json")
+
+async def handle_initialize(request: MCPRequest) -> MCPResponse:
+    """initialize: 初期化"""
+    return MCPResponse(
+        id=request.id,
+        result={
+            "protocolVersion": MCP_CONFIG["protocol_version"],
+            "capabilities": {},
+            "serverInfo": {
+                "name": MCP_CONFIG["server_name"],
+                "version": MCP_CONFIG["version"]
+            }
+        }
+    )
+
+async def handle_tools_list(request: MCPRequest) -> MCPResponse:
+    """tools/list: ツール一覧（一元管理から取得）"""
+    return MCPResponse(
+        id=request.id,
+        result={
+            "tools": await tools_manager.get_mcp_tools_format()
+        }
+    )
+
+# 要約モードの debug_response に残す項目（件数・時間・標準化結果など小さな値のみ）
+DEBUG_SUMMARY_KEYS = (
+    "standardize_parameter", "execution_time_ms", "results_count",
+    "cache_hit", "truncated", "error", "error_type"
+)
+
+def summarize_debug(debug_response: Optional[Dict]) -> Optional[Dict]:
+    """debug_response から大きな項目（プロンプト・検索結果・LLM応答）を除く"""
+    if debug_response is None:
+        return None
+    return {key: debug_response[key] for key in DEBUG_SUMMARY_KEYS if key in debug_response}
+
+async def call_tool(request_id: int, tool_name: str, arguments: dict, full_debug: bool = True) -> MCPResponse:
+    """ツール名・引数から動的にツールを実行（full_debug=False なら debug_response は要約のみ）"""
+    logger.debug("[MCP_ENDPOINT] Tool name: %s", tool_name)
+    logger.debug("[MCP_ENDPOINT] Arguments: %s", arguments)
+    
+    # 動的ツール実行
+    if await tools_manager.is_valid_tool(tool_name):
+        logger.debug("[MCP_ENDPOINT] Calling %s", tool_name)
+        tool_function = await tools_manager.get_tool_function(tool_name)
         
-        elif method == "tools/list":
-            # ツール一覧（一元管理から取得）
-            return MCPResponse(
-                id=request.id,
-                result={
-                    "tools": await tools_manager.get_mcp_tools_format()
-                }
+        if tool_function:
+            # ツール側で要約モード時にデバッグ専用の大きな文字列を組み立てないよう設定を伝える
+            token = full_debug_var.set(full_debug)
+            try:
+                tool_response = await tool_function(arguments)
+            finally:
+                full_debug_var.reset(token)
+            tool_response.id = request_id
+            if not full_debug:
+                tool_response.debug_response = summarize_debug(tool_response.debug_response)
+            logger.debug("[MCP_ENDPOINT] About to return response: %s", tool_response)
+            return tool_response
+        else:
+            error_msg = f"Tool function not found: {tool_name}"
+            response = MCPResponse(
+                id=request_id,
+                result=error_msg,
+                error=error_msg
             )
-        
-        elif method == "tools/call":
-            # ツール実行
-            tool_name = params.get("name")
-            arguments = params.get("arguments", {})
-            
-            print(f"[MCP_ENDPOINT] Tool name: {tool_name}")
-            print(f"[MCP_ENDPOINT] Arguments: {arguments}")
-            
-            # 動的ツール実行
-            if await tools_manager.is_valid_tool(tool_name):
-                print(f"[MCP_ENDPOINT] Calling {tool_name}")
-                tool_function = await tools_manager.get_tool_function(tool_name)
-                
-                if tool_function:
-                    tool_response = await tool_function(arguments)
-                    tool_response.id = request.id
-                    print(f"[MCP_ENDPOINT] About to return response: {tool_response}")
-                    return tool_response
-                else:
-                    error_msg = f"Tool function not found: {tool_name}"
-                    response = MCPResponse(
-                        id=request.id,
-                        result=error_msg,
-                        error=error_msg
-                    )
-                    print(f"[MCP_ENDPOINT] About to return error response: {response}")
-                    return response
-            else:
-                error_msg = f"Unknown tool: {tool_name}"
-                response = MCPResponse(
-                    id=request.id,
-                    result=error_msg,
-                    error=error_msg
-                )
-                print(f"[MCP_ENDPOINT] About to return unknown tool response: {response}")
-                return response
-        
+            logger.debug("[MCP_ENDPOINT] About to return error response: %s", response)
+            return response
+    else:
+        error_msg = f"Unknown tool: {tool_name}"
+        response = MCPResponse(
+            id=request_id,
+            result=error_msg,
+            error=error_msg
+        )
+        logger.debug("[MCP_ENDPOINT] About to return unknown tool response: %s", response)
+        return response
+
+async def handle_tools_call(request: MCPRequest) -> MCPResponse:
+    """tools/call: ツール実行"""
+    return await call_tool(request.id, request.params.get("name"), request.params.get("arguments", {}),
+                           to_flag(request.params.get("debug"), MCP_CONFIG["full_debug_response"]))
+
+# tools/call_batch の1リクエストあたりの最大呼び出し数と同時実行数
+# （各ツールが Bedrock 呼び出しとDB接続を伴うため、1リクエストでの展開を制限）
+CALL_BATCH_MAX_CALLS = 10
+CALL_BATCH_CONCURRENCY = 4
+
+async def handle_tools_call_batch(request: MCPRequest) -> MCPResponse:
+    """tools/call_batch: 複数ツールを並行実行（結果は呼び出し順、失敗は呼び出しごとに返す）"""
+    calls = request.params.get("calls", [])
+    if not isinstance(calls, list) or not all(isinstance(call, dict) for call in calls):
+        error_msg = "calls はオブジェクトの配列で指定してください"
+        return MCPResponse(id=request.id, result=error_msg, error=error_msg)
+    if len(calls) > CALL_BATCH_MAX_CALLS:
+        error_msg = f"calls は最大{CALL_BATCH_MAX_CALLS}件までです（指定: {len(calls)}件）"
+        return MCPResponse(id=request.id, result=error_msg, error=error_msg)
+    
+    full_debug = to_flag(request.params.get("debug"), MCP_CONFIG["full_debug_response"])
+    semaphore = asyncio.Semaphore(CALL_BATCH_CONCURRENCY)
+    
+    async def call_bounded(call: dict) -> MCPResponse:
+        async with semaphore:
+            return await call_tool(request.id, call.get("name"), call.get("arguments", {}), full_debug)
+    
+    responses = await asyncio.gather(*(call_bounded(call) for call in calls), return_exceptions=True)
+    
+    results = []
+    for call, response in zip(calls, responses):
+        if isinstance(response, Exception):
+            logger.error("[MCP_ENDPOINT] Exception in tools/call_batch (%s): %s", call.get("name"), response)
+            results.append({
+                "name": call.get("name"),
+                "result": f"サーバーエラー: {str(response)}",
+                "error": str(response),
+                "debug_response": {"error": str(response), "error_type": type(response).__name__}
+            })
         else:
+            results.append({
+                "name": call.get("name"),
+                "result": response.result,
+                "error": response.error,
+                "debug_response": response.debug_response
+            })
+    
+    return MCPResponse(id=request.id, result=results)
+
+# MCPメソッド → 処理関数のディスパッチテーブル
+MCP_METHOD_HANDLERS = {
+    "initialize": handle_initialize,
+    "tools/list": handle_tools_list,
+    "tools/call": handle_tools_call,
+    "tools/call_batch": handle_tools_call_batch
+}
+
+async def handle_mcp_request(request: MCPRequest) -> MCPResponse:
+    """MCPリクエスト処理"""
+    logger.debug("[MCP_ENDPOINT] === REQUEST START ===")
+    logger.debug("[MCP_ENDPOINT] Request received: %s", request)
+    
+    method = request.method
+    params = request.params
+    
+    try:
+        handler = MCP_METHOD_HANDLERS.get(method)
+        if handler is None:
             error_msg = f"Unknown method: {method}"
             return MCPResponse(
                 id=request.id,
                 result=error_msg,
                 error=error_msg
             )
+        
+        return await handler(request)
     
     except Exception as e:
-        print(f"[MCP_ENDPOINT] EXCEPTION CAUGHT!")
-        print(f"[MCP_ENDPOINT] Exception: {e}")
+        # スタックトレースはログ出力時にのみ整形される
+        logger.exception("[MCP_ENDPOINT] Exception in %s", method)
         
         return MCPResponse(
             id=request.id,
@@ -115,18 +262,29 @@ async def mcp_endpoint(request: MCPRequest):
 
 @app.get("/tools")
 async def list_available_tools():
-    """MCPプロトコル準拠のツール一覧"""
-    return {
-        "tools": await tools_manager.get_tools_list()
-    }
+    """MCPプロトコル準拠のツール一覧（シリアライズ済みボディを返す）"""
+    return Response(content=await tools_manager.get_tools_list_json(), media_type="application/json")
 
 @app.get("/tools/descriptions")
 async def get_tool_descriptions():
-    """ツール詳細情報（AIChat用）"""
-    return {
-        "tools": await tools_manager.get_tools_descriptions()
-    }
+    """ツール詳細情報（AIChat用、シリアライズ済みボディを返す）"""
+    return Response(content=await tools_manager.get_tools_descriptions_json(), media_type="application/json")
+
+@app.post("/admin/tools/invalidate")
+async def invalidate_tools():
+    """ツール一覧のキャッシュを破棄（MCP-Management でツール定義を更新した時に呼び出す）"""
+    tools_manager.invalidate_cache()
+    return {"status": "ok"}
+
+@app.post("/admin/prompts/invalidate")
+async def invalidate_prompts(key: Optional[str] = None):
+    """システムプロンプトのキャッシュを破棄（プロンプト更新時に呼び出す、?key= 指定でそのプロンプトのみ）"""
+    clear_system_prompt_cache(key)
+    return {"status": "ok"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8004)
+    # libuv ベースのイベントループと C 実装の HTTP パーサーを使用
+    # 複数ワーカーはインポート文字列指定が必要
+    # log_config=None で uvicorn のログもアプリと同じ logging 設定（LOG_LEVEL）に流す
+    uvicorn.run("main:app", host="0.0.0.0", port=8004, loop="uvloop", http="httptools", workers=WORKERS, log_config=None)
@@ -0,0 +1,12 @@
+-- CRM-MCP パフォーマンス用インデックス
+-- get_customer_holdings: holdings.customer_id での絞り込み
+-- search_customers_by_bond_maturity: customer_id 結合 + maturity_date 範囲、category_code の部分一致
+
+-- 顧客ID + 満期日（保有商品取得・債券満期検索の結合と範囲条件）
+CREATE INDEX IF NOT EXISTS idx_holdings_customer_maturity
+    ON holdings (customer_id, maturity_date);
+
+-- 商品区分の部分一致（ILIKE '%BOND%'）をトライグラムインデックスで支援
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_products_category_code_trgm
+    ON products USING gin (category_code gin_trgm_ops);
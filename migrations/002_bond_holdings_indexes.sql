@@ -0,0 +1,12 @@
+-- CRM-MCP 債券・商品起点の検索用インデックス
+-- search_customers_by_bond_maturity: 債券商品の特定 + 商品起点の満期日範囲
+-- get_customers_by_product_text: holdings.product_id での絞り込み
+
+-- 債券商品のみの部分インデックス（クエリの ILIKE '%BOND%' 条件と同一述語）
+CREATE INDEX IF NOT EXISTS idx_products_bond
+    ON products (product_id)
+    WHERE category_code ILIKE '%BOND%';
+
+-- 商品ID + 満期日（債券商品から保有を引く結合順、商品別保有顧客の絞り込み）
+CREATE INDEX IF NOT EXISTS idx_holdings_product_maturity
+    ON holdings (product_id, maturity_date);
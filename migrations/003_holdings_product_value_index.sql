@@ -0,0 +1,9 @@
+-- CRM-MCP 商品別保有顧客の上位件数取得用インデックス
+-- get_customers_by_product_text: 商品ごとに評価額の大きい順で上位 N 件（row_number() OVER (PARTITION BY product_id ORDER BY current_value DESC NULLS LAST)）
+
+-- NULLS LAST 指定前の版で作成済みのインデックス（クエリの並び順と一致しないため置き換え）
+DROP INDEX IF EXISTS idx_holdings_product_value;
+
+-- 商品ID + 評価額降順・NULL は末尾（ウィンドウ関数のソートをインデックス順の走査で代替）
+CREATE INDEX IF NOT EXISTS idx_holdings_product_value_nulls_last
+    ON holdings (product_id, current_value DESC NULLS LAST);
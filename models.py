@@ -1,15 +1,17 @@
 # CRM-MCP Data Models
 
-from pydantic import BaseModel
+import msgspec
 from typing import Dict, Any, Optional
 
-class MCPRequest(BaseModel):
+class MCPRequest(msgspec.Struct, kw_only=True):
+    # リクエストは msgspec で直接デコード・検証（Pydantic より高速）
     jsonrpc: str = "2.0"
     id: int
     method: str
     params: Dict[str, Any] = {}
 
-class MCPResponse(BaseModel):
+class MCPResponse(msgspec.Struct, kw_only=True):
+    # サーバー側で組み立てる信頼済みデータのため、生成時の検証は行わない
     jsonrpc: str = "2.0"
     id: Optional[int] = None
     result: Any = None
@@ -1,20 +1,109 @@
 # Bond maturity search tool
 
+import re
 import time
+import unicodedata
 import json
-from typing import Dict, Any, Tuple, List
+import logging
+import orjson
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
 from utils.database import get_db_connection
+from utils.cache import TTLCache
 from utils.system_prompt import get_system_prompt
-from utils.llm_util import llm_util
+from utils.llm_util import llm_util, STANDARDIZE_MAX_TOKENS, STANDARDIZE_MODEL_ID, STANDARDIZE_LATENCY
+from utils.json_util import canonical_input, to_flag
 from models import MCPResponse
-from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+# 債券満期検索クエリ
+# 条件は NULL 許容パラメータで表現し、SQL文字列を固定することで
+# asyncpg のプリペアドステートメントキャッシュと PostgreSQL のプランを再利用する
+# 顧客ごとに条件を満たす最も近い満期の債券1件を LATERAL で取得（DISTINCT による重複除去が不要）
+# 満期日はSQL側でISO形式文字列に変換、件数は満期の近い順に $4 件まで
+BOND_MATURITY_QUERY = """
+    SELECT c.customer_id, c.name, c.email, c.phone, c.risk_tolerance,
+           to_char(m.maturity_date, 'YYYY-MM-DD') AS maturity_date, m.product_name, m.category_code
+    FROM customers c
+    JOIN LATERAL (
+        SELECT h.maturity_date, p.product_name, p.category_code
+        FROM holdings h
+        JOIN products p ON h.product_id = p.product_id
+        WHERE h.customer_id = c.customer_id
+          AND p.category_code ILIKE '%BOND%'
+          AND ($1::int IS NULL OR h.maturity_date <= CURRENT_DATE + make_interval(days => $1::int))
+          AND ($2::date IS NULL OR h.maturity_date >= $2::date)
+          AND ($3::date IS NULL OR h.maturity_date <= $3::date)
+        ORDER BY h.maturity_date ASC
+        LIMIT 1
+    ) m ON true
+    ORDER BY m.maturity_date ASC
+    LIMIT $4
+"""
+
+# 検索結果の最大件数（LLM整形への入力量の上限）
+BOND_MATURITY_LIMIT = 200
+
+# tool_debug に載せる検索結果の最大件数
+DEBUG_RESULTS_LIMIT = 20
+
+# 接続確立時のウォームアップ用引数（満期日の範囲が空になり0件を返す）
+BOND_MATURITY_WARMUP = (BOND_MATURITY_QUERY, (None, date.max, date.min, BOND_MATURITY_LIMIT))
+
+# include_holdings 指定時に顧客ごとに付ける保有商品の最大件数（評価額の大きい順）
+BOND_HOLDINGS_PER_CUSTOMER_LIMIT = 5
+
+# 満期検索結果の顧客ごとに保有件数・評価額合計と上位の保有商品（評価額順、最大 $5 件）を付けて1往復で返すクエリ
+# get_customer_holdings を続けて呼ぶ代わりに使う（include_holdings 指定時）
+BOND_MATURITY_WITH_HOLDINGS_QUERY = f"""
+    WITH matched AS ({BOND_MATURITY_QUERY})
+    SELECT m.*, agg.holdings_count, agg.holdings_total_value, hs.holdings
+    FROM matched m
+    CROSS JOIN LATERAL (
+        SELECT count(*) AS holdings_count,
+               COALESCE(sum(h.current_value), 0)::float8 AS holdings_total_value
+        FROM holdings h
+        WHERE h.customer_id = m.customer_id
+    ) agg
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(json_agg(json_build_object(
+                   'holding_id', t.holding_id,
+                   'product_code', t.product_code,
+                   'product_name', t.product_name,
+                   'category_code', t.category_code,
+                   'quantity', t.quantity,
+                   'unit_price', t.unit_price,
+                   'current_price', t.current_price,
+                   'current_value', t.current_value,
+                   'currency', t.currency,
+                   'purchase_date', t.purchase_date
+               ) ORDER BY t.current_value DESC), '[]') AS holdings
+        FROM (
+            SELECT h.holding_id, p.product_code, p.product_name, p.category_code,
+                   COALESCE(h.quantity, 0)::float8 AS quantity,
+                   COALESCE(h.unit_price, 0)::float8 AS unit_price,
+                   COALESCE(h.current_price, 0)::float8 AS current_price,
+                   COALESCE(h.current_value, 0)::float8 AS current_value,
+                   p.currency,
+                   to_char(h.purchase_date, 'YYYY-MM-DD') AS purchase_date
+            FROM holdings h
+            JOIN products p ON h.product_id = p.product_id
+            WHERE h.customer_id = m.customer_id
+            ORDER BY h.current_value DESC NULLS LAST
+            LIMIT $5
+        ) t
+    ) hs
+    ORDER BY m.maturity_date ASC
+"""
 
 async def search_customers_by_bond_maturity(params: Dict[str, Any]) -> MCPResponse:
     """債券満期日条件での顧客検索"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     
-    print(f"[search_customers_by_bond_maturity] === FUNCTION START ===")
-    print(f"[search_customers_by_bond_maturity] Received raw params: {params}")
+    logger.debug("[search_customers_by_bond_maturity] === FUNCTION START ===")
+    logger.debug("[search_customers_by_bond_maturity] Received raw params: %s", params)
     
     # Try外で初期化（エラー時情報保持）
     tool_debug = {
@@ -30,57 +119,182 @@ async def search_customers_by_bond_maturity(params: Dict[str, Any]) -> MCPRespon
     }
     
     try:
+        # LLM入力（dict の repr ではなく正規化した文字列を使い、キャッシュキーを安定させる）
+        raw_input = canonical_input(params)
+        
         # 引数標準化処理（参照渡し）
-        standardized_params = await standardize_bond_maturity_arguments(str(params), tool_debug)
-        print(f"[search_customers_by_bond_maturity] Standardized params: {standardized_params}")
+        standardized_params = await standardize_bond_maturity_arguments(raw_input, tool_debug)
+        logger.debug("[search_customers_by_bond_maturity] Standardized params: %s", standardized_params)
         
         days_until_maturity = standardized_params.get("days_until_maturity")
         maturity_date_from = standardized_params.get("maturity_date_from")
         maturity_date_to = standardized_params.get("maturity_date_to")
         
-        print(f"[search_customers_by_bond_maturity] Extracted values:")
-        print(f"  - days_until_maturity: {days_until_maturity}")
-        print(f"  - maturity_date_from: {maturity_date_from}")
-        print(f"  - maturity_date_to: {maturity_date_to}")
+        logger.debug("[search_customers_by_bond_maturity] Extracted values: days_until_maturity=%s maturity_date_from=%s maturity_date_to=%s",
+                     days_until_maturity, maturity_date_from, maturity_date_to)
         
-        # データベース接続・クエリ実行（参照渡し）
-        customers = await execute_bond_maturity_query(days_until_maturity, maturity_date_from, maturity_date_to, tool_debug)
+        # データベース接続・クエリ実行（参照渡し、include_holdings 指定時は保有商品も同時取得）
+        include_holdings = to_flag(params.get("include_holdings"), False)
+        customers = await execute_bond_maturity_query(days_until_maturity, maturity_date_from, maturity_date_to, tool_debug, include_holdings)
         
         # 結果テキスト化（参照渡し）
-        result_text = await format_bond_maturity_results(customers, str(params), tool_debug)
+        result_text = await format_bond_maturity_results(customers, tool_debug)
         
-        execution_time = time.time() - start_time
+        execution_time = time.perf_counter() - start_time
         tool_debug["execution_time_ms"] = round(execution_time * 1000, 2)
         tool_debug["results_count"] = len(customers)
         
-        print(f"[search_customers_by_bond_maturity] Returning result with {len(customers)} customers")
-        print(f"[search_customers_by_bond_maturity] === FUNCTION END ===")
+        logger.info("[search_customers_by_bond_maturity] %s customers in %.1fms", len(customers), tool_debug["execution_time_ms"])
+        logger.debug("[search_customers_by_bond_maturity] === FUNCTION END ===")
         
         return MCPResponse(result=result_text, debug_response=tool_debug)
         
     except Exception as e:
-        execution_time = time.time() - start_time
+        execution_time = time.perf_counter() - start_time
         error_message = f"債券満期検索エラー: {str(e)}"
         
         tool_debug["execution_time_ms"] = round(execution_time * 1000, 2)
         tool_debug["results_count"] = 0
         
-        print(f"[search_customers_by_bond_maturity] ERROR: {error_message}")
-        print(f"[search_customers_by_bond_maturity] === FUNCTION END ===")
+        logger.error("[search_customers_by_bond_maturity] ERROR: %s", error_message)
+        logger.debug("[search_customers_by_bond_maturity] === FUNCTION END ===")
         
         return MCPResponse(result=error_message, debug_response=tool_debug, error=str(e))
 
+# ルールベース標準化用パターン（「6ヶ月以内」「1.5年以内」「半年以内」「2週間以内」「2025-01-01〜2025-03-31」「2025年1月1日から2025年3月31日」）
+_DURATION_PATTERN = re.compile(r"(?<![\d.])(\d+(?:\.\d+)?)\s*(ヶ月|か月|カ月|ケ月|ヵ月|months?|週間|週|weeks?|年|years?|日|days?)", re.IGNORECASE)
+_WITHIN_PATTERN = re.compile(r"以内|以下|within", re.IGNORECASE)
+# 過去方向・基準のずれを表す語（「過去6ヶ月以内」「6ヶ月前」など）。今日から先の期間と解釈できないためLLMに任せる
+_NON_FORWARD_PATTERN = re.compile(r"過去|以前|前|昨|先|経過|ago|past|before|last|previous|prior", re.IGNORECASE)
+_ISO_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+_JP_DATE_PATTERN = re.compile(r"(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日")
+_CALENDAR_YEAR_PATTERN = re.compile(r"\d{4}\s*年")
+
+# 期間の単位 → 日数（月単位の表記はすべて30日）
+_UNIT_TO_DAYS = {
+    "年": 365, "year": 365, "years": 365,
+    "週": 7, "週間": 7, "week": 7, "weeks": 7,
+    "日": 1, "day": 1, "days": 1
+}
+
+# LLM標準化結果のキャッシュ（正規化した入力文字列ごと、1時間）
+_standardize_cache = TTLCache(ttl=3600.0, maxsize=512)
+
+# キャッシュキー正規化で1つにまとめる空白（全角空白は NFKC で半角に変換済み）
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# 検索結果のキャッシュ（検索条件ごと、30秒）
+_query_cache = TTLCache(ttl=30.0, maxsize=256)
+
+# LLM応答からJSONオブジェクト部分を抽出するデコーダー（前後に説明文が付く場合に対応）
+_JSON_DECODER = json.JSONDecoder()
+
+def _decode_json_object(text: str) -> Any:
+    """最初の「{」からJSONを1つだけデコード（後続の文字列は無視、入れ子の括弧にも対応）"""
+    start = text.find("{")
+    if start < 0:
+        return orjson.loads(text)
+    return _JSON_DECODER.raw_decode(text, start)[0]
+
+# 標準化済みの引数キー（include_holdings は検索条件ではないため判定から除く）
+_STANDARDIZED_KEYS = frozenset({"days_until_maturity", "maturity_date_from", "maturity_date_to"})
+
+def _structured_maturity_params(raw_input: str) -> Optional[Dict[str, Any]]:
+    """既に標準化済みの形式（対象キーのみのJSONオブジェクト）ならそのまま返す（該当しなければ None）"""
+    if not raw_input.lstrip().startswith("{"):
+        return None
+    try:
+        params = orjson.loads(raw_input)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(params, dict):
+        return None
+    keys = set(params) - {"include_holdings"}
+    if not keys or not keys <= _STANDARDIZED_KEYS:
+        return None
+    return {key: params[key] for key in keys}
+
+def _standardize_cache_key(raw_input: str) -> str:
+    """LLM標準化キャッシュのキー（全角半角・大文字小文字・空白の違いのみ吸収）
+    
+    記号・数字・語の一部は意味を変えうるため除かない（「1.5ヶ月」と「15ヶ月」を同一視しない）
+    """
+    text = unicodedata.normalize("NFKC", raw_input).lower()
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+@lru_cache(maxsize=1024)
+def _parse_maturity(raw_input: str) -> Optional[Dict[str, Any]]:
+    """定型的な満期条件をLLMなしで標準化（判定できなければ None）"""
+    text = raw_input.replace("半年", "6ヶ月")
+    
+    if _NON_FORWARD_PATTERN.search(text):
+        return None
+    
+    # 日付（ISO形式・「YYYY年M月D日」）を抽出し、期間表現の判定対象から除く
+    dates = _ISO_DATE_PATTERN.findall(text)
+    dates += [f"{year}-{int(month):02d}-{int(day):02d}" for year, month, day in _JP_DATE_PATTERN.findall(text)]
+    text = _JP_DATE_PATTERN.sub(" ", text)
+    
+    # 「2025年3月」のような日付を伴わない暦年表記は期間と誤認しやすいためLLMに任せる
+    if _CALENDAR_YEAR_PATTERN.search(text):
+        return None
+    
+    durations = _DURATION_PATTERN.findall(text)
+    
+    if len(dates) == 2 and not durations:
+        try:
+            date_from, date_to = sorted(date.fromisoformat(d) for d in dates)
+        except ValueError:
+            return None
+        return {"maturity_date_from": date_from.isoformat(), "maturity_date_to": date_to.isoformat()}
+    
+    if len(durations) == 1 and not dates and _WITHIN_PATTERN.search(text):
+        amount, unit = durations[0]
+        # 小数の期間（「1.5年」）は日数換算後に切り捨て
+        return {"days_until_maturity": int(float(amount) * _UNIT_TO_DAYS.get(unit.lower(), 30))}
+    
+    return None
+
 async def standardize_bond_maturity_arguments(raw_input: str, tool_debug: Dict) -> Dict[str, Any]:
-    """債券満期日検索の引数を標準化（LLMベース）"""
-    print(f"[standardize_bond_maturity_arguments] Raw input: {raw_input}")
+    """債券満期日検索の引数を標準化（定型入力はルールベース、それ以外はLLM）"""
+    logger.debug("[standardize_bond_maturity_arguments] Raw input: %s", raw_input)
+    
+    # 標準化済みの引数（エージェントからの構造化呼び出し）はそのまま使用
+    structured = _structured_maturity_params(raw_input)
+    if structured is not None:
+        logger.debug("[standardize_bond_maturity_arguments] Structured input: %s", structured)
+        tool_debug["standardize_response"] = "structured"
+        tool_debug["standardize_parameter"] = str(structured)
+        return structured
+    
+    # 定型入力はLLMを呼ばずに標準化（キャッシュ共有のためコピーを返す）
+    parsed = _parse_maturity(raw_input)
+    if parsed is not None:
+        standardized_params = dict(parsed)
+        logger.debug("[standardize_bond_maturity_arguments] Rule-based output: %s", standardized_params)
+        tool_debug["standardize_response"] = "rule-based"
+        tool_debug["standardize_parameter"] = str(standardized_params)
+        return standardized_params
+    
+    # 同等の入力のLLM標準化結果を再利用（相対日付表現に備えて当日の日付もキーに含める）
+    cache_key = (_standardize_cache_key(raw_input), date.today().isoformat())
+    cached = _standardize_cache.get(cache_key)
+    if cached is not None:
+        standardized_params, response, full_prompt_text = cached
+        logger.debug("[standardize_bond_maturity_arguments] Cache hit: %s", standardized_params)
+        tool_debug["standardize_prompt"] = full_prompt_text
+        tool_debug["standardize_response"] = response
+        tool_debug["standardize_parameter"] = str(standardized_params)
+        return dict(standardized_params)
     
     # データベースからシステムプロンプト取得
     system_prompt = await get_system_prompt("search_customers_by_bond_maturity_pre")
     
-    print(f"[standardize_bond_maturity_arguments] === LLM CALL START ===")
-    response = await llm_util.call_claude(system_prompt, raw_input)
-    print(f"[standardize_bond_maturity_arguments] LLM Raw Response: {response}")
-    print(f"[standardize_bond_maturity_arguments] === LLM CALL END ===")
+    logger.debug("[standardize_bond_maturity_arguments] === LLM CALL START ===")
+    response = await llm_util.call_claude(system_prompt, raw_input, max_tokens=STANDARDIZE_MAX_TOKENS, model_id=STANDARDIZE_MODEL_ID,
+                                          latency=STANDARDIZE_LATENCY)
+    logger.debug("[standardize_bond_maturity_arguments] LLM Raw Response: %s", response)
+    logger.debug("[standardize_bond_maturity_arguments] === LLM CALL END ===")
     
     full_prompt_text = f"{system_prompt}\n\nUser Input: {raw_input}"
     
@@ -89,85 +303,76 @@ async def standardize_bond_maturity_arguments(raw_input: str, tool_debug: Dict)
     tool_debug["standardize_response"] = response
     
     try:
-        standardized_params = json.loads(response)
-        print(f"[standardize_bond_maturity_arguments] Final Standardized Output: {standardized_params}")
+        standardized_params = _decode_json_object(response)
+        logger.debug("[standardize_bond_maturity_arguments] Final Standardized Output: %s", standardized_params)
         tool_debug["standardize_parameter"] = str(standardized_params)
-        return standardized_params
+        _standardize_cache.set(cache_key, (standardized_params, response, full_prompt_text))
+        return dict(standardized_params)
     except json.JSONDecodeError as e:
-        print(f"[standardize_bond_maturity_arguments] JSON parse error: {e}")
+        logger.warning("[standardize_bond_maturity_arguments] JSON parse error: %s", e)
         tool_debug["standardize_parameter"] = f"JSONパースエラー: {str(e)}"
         return {}
 
-async def execute_bond_maturity_query(days_until_maturity, maturity_date_from, maturity_date_to, tool_debug: Dict) -> List[Dict]:
-    """債券満期クエリ実行"""
-    # データベース接続・クエリ実行
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    query = """
-    SELECT DISTINCT c.customer_id, c.name, c.email, c.phone, c.risk_tolerance,
-           h.maturity_date, p.product_name, p.category_code
-    FROM customers c
-    JOIN holdings h ON c.customer_id = h.customer_id
-    JOIN products p ON h.product_id = p.product_id
-    WHERE p.category_code ILIKE '%BOND%'
-    """
-    query_params = []
-    
-    # 空パラメータ対応: 全て空なら0件になる条件を追加
+def to_interval_days(days_until_maturity) -> int:
+    """満期までの日数をバインド用の整数に正規化（"180" や 180.0 も受け付ける）"""
+    days = int(float(str(days_until_maturity).strip()))
+    if days < 0:
+        raise ValueError(f"days_until_maturity must be non-negative: {days_until_maturity}")
+    return days
+
+async def execute_bond_maturity_query(days_until_maturity, maturity_date_from, maturity_date_to, tool_debug: Dict,
+                                      include_holdings: bool = False) -> List[Dict]:
+    """債券満期クエリ実行（include_holdings=True の場合は顧客ごとの holdings 一覧を付与）"""
+    # 空パラメータ対応: 全て空なら0件（DB問い合わせ不要）
     if not days_until_maturity and not maturity_date_from and not maturity_date_to:
-        query += " AND 1 = 0"
+        logger.debug("[search_customers_by_bond_maturity] No conditions given, skipping query")
+        tool_debug["executed_query_results"] = []
+        return []
     
-    if days_until_maturity:
-        query += f" AND h.maturity_date <= CURRENT_DATE + INTERVAL '{days_until_maturity} days'"
+    # 未指定条件は NULL で渡す（asyncpgは日付型パラメータに date オブジェクトを要求）
+    query = BOND_MATURITY_WITH_HOLDINGS_QUERY if include_holdings else BOND_MATURITY_QUERY
+    query_params = [
+        to_interval_days(days_until_maturity) if days_until_maturity else None,
+        date.fromisoformat(str(maturity_date_from)) if maturity_date_from else None,
+        date.fromisoformat(str(maturity_date_to)) if maturity_date_to else None,
+        BOND_MATURITY_LIMIT
+    ]
+    if include_holdings:
+        query_params.append(BOND_HOLDINGS_PER_CUSTOMER_LIMIT)
     
-    if maturity_date_from:
-        query += " AND h.maturity_date >= %s"
-        query_params.append(maturity_date_from)
+    logger.debug("[search_customers_by_bond_maturity] Final query: %s", query)
+    logger.debug("[search_customers_by_bond_maturity] Query params: %s", query_params)
     
-    if maturity_date_to:
-        query += " AND h.maturity_date <= %s"
-        query_params.append(maturity_date_to)
+    # tool_debugにクエリ情報設定
+    tool_debug["executed_query"] = query
     
-    query += " ORDER BY h.maturity_date ASC"
+    # 同一条件の短時間の再検索はDBを叩かない（CURRENT_DATE 基準のため当日の日付もキーに含める）
+    cache_key = (*query_params, include_holdings, date.today())
+    customers = _query_cache.get(cache_key)
+    tool_debug["cache_hit"] = customers is not None
     
-    print(f"[search_customers_by_bond_maturity] Final query: {query}")
-    print(f"[search_customers_by_bond_maturity] Query params: {query_params}")
+    if customers is None:
+        # SQL実行（プールから接続取得）
+        async with get_db_connection() as conn:
+            results = await conn.fetch(query, *query_params)
+        
+        logger.debug("[search_customers_by_bond_maturity] Query executed, found %s rows", len(results))
+        
+        # 結果配列作成（holdings は json_agg のJSON文字列のためデコード）
+        if include_holdings:
+            customers = [{**row, "holdings": orjson.loads(row["holdings"])} for row in results]
+        else:
+            customers = [dict(row) for row in results]
+        _query_cache.set(cache_key, customers)
     
-    # tool_debugにクエリ情報設定
-    tool_debug["executed_query"] = query
+    tool_debug["truncated"] = len(customers) >= BOND_MATURITY_LIMIT
     
-    # SQL実行
-    if query_params:
-        cursor.execute(query, query_params)
-    else:
-        cursor.execute(query)
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    print(f"[search_customers_by_bond_maturity] Query executed, found {len(results)} rows")
-    
-    # 結果配列作成
-    customers = []
-    for row in results:
-        customers.append({
-            "customer_id": row['customer_id'],
-            "name": row['name'],
-            "email": row['email'],
-            "phone": row['phone'],
-            "risk_tolerance": row['risk_tolerance'],
-            "maturity_date": row['maturity_date'].isoformat() if row['maturity_date'] else None,
-            "product_name": row['product_name'],
-            "category_code": row['category_code']
-        })
-    
-    # tool_debugに結果設定
-    tool_debug["executed_query_results"] = customers
+    # tool_debugには先頭のみ設定（全件は results_count で把握、レスポンスの肥大化を防ぐ）
+    tool_debug["executed_query_results"] = customers[:DEBUG_RESULTS_LIMIT]
     
     return customers
 
-async def format_bond_maturity_results(customers: list, user_input: str, tool_debug: Dict) -> str:
+async def format_bond_maturity_results(customers: list, tool_debug: Dict) -> str:
     """債券満期検索結果をテキスト化"""
     if not customers:
         return "債券満期検索結果: 該当する顧客はいませんでした。"
@@ -175,17 +380,26 @@ async def format_bond_maturity_results(customers: list, user_input: str, tool_de
     # データベースからシステムプロンプト取得
     system_prompt = await get_system_prompt("search_customers_by_bond_maturity_post")
     
+    # 保有商品一覧はLLM整形の入力に含めない（顧客ごとの保有件数・評価額合計のみ渡し、プロンプトの肥大化を防ぐ）
+    format_rows = [
+        {key: value for key, value in customer.items() if key != "holdings"} if "holdings" in customer else customer
+        for customer in customers
+    ]
+    
     # 呼び出し元でデータ結合（責任明確化）
-    data_json = json.dumps(customers, ensure_ascii=False, default=str, indent=2)
+    data_json = orjson.dumps(format_rows, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
     full_prompt = f"{system_prompt}\n\nData:\n{data_json}"
+    if tool_debug.get("truncated"):
+        # 上限で打ち切った場合は全件列挙ではなく要約を求める
+        full_prompt += f"\n\n※ 該当顧客が多いため満期の近い上位{len(customers)}件のみを示しています。全件を列挙せず傾向と主な顧客を要約してください。"
     
     # tool_debugにformat_request（full_prompt）を設定
     tool_debug["format_request"] = full_prompt
     
     # 完全プロンプトでLLM呼び出し
     result_text, execution_time = await llm_util.call_llm_simple(full_prompt)
-    print(f"[format_bond_maturity_results] Execution time: {execution_time}ms")
-    print(f"[format_bond_maturity_results] Formatted result: {result_text[:200]}...")
+    logger.debug("[format_bond_maturity_results] Execution time: %sms", execution_time)
+    logger.debug("[format_bond_maturity_results] Formatted result: %.200s...", result_text)
     
     # tool_debugにformat_responseを設定
     tool_debug["format_response"] = result_text
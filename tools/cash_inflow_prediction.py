@@ -1,20 +1,63 @@
 # Cash inflow prediction tool from sales notes
 
 import time
-import json
-from typing import Dict, Any, List
+import orjson
+import asyncio
+import logging
+from typing import Dict, Any, List, Tuple
 from utils.database import get_db_connection
+from utils.cache import TTLCache
 from utils.system_prompt import get_system_prompt
-from utils.llm_util import llm_util
+from utils.llm_util import llm_util, STANDARDIZE_MAX_TOKENS, STANDARDIZE_MODEL_ID, STANDARDIZE_LATENCY
+from utils.json_util import canonical_input, json_default
 from models import MCPResponse
-from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+# 営業メモ取得クエリ（顧客IDは配列1パラメータで渡し、SQL文字列を固定）
+# 件数上限は顧客ごとに $2 件まで適用し、全体の上限 $3 件は各顧客の1件目から順に割り当てる
+# （メモの多い1顧客が他の顧客を解析対象から押し出さない。sales_notes に日時列を前提としないため顧客内の順序は不定）
+# notes_total は条件に合う営業メモの総数（顧客ごと・全体いずれの上限による打ち切りも判定できる）
+SALES_NOTES_QUERY = """
+    SELECT customer_id, name, sales_note, notes_total
+    FROM (
+        SELECT customer_id, name, sales_note, rn, notes_total
+        FROM (
+            SELECT c.customer_id, c.name, sn.content AS sales_note,
+                   row_number() OVER (PARTITION BY sn.customer_id) AS rn,
+                   count(*) OVER () AS notes_total
+            FROM sales_notes sn
+            JOIN customers c ON c.customer_id = sn.customer_id
+            WHERE sn.customer_id = ANY($1::int[])
+        ) ranked
+        WHERE rn <= $2
+        ORDER BY rn, customer_id
+        LIMIT $3
+    ) notes
+    ORDER BY customer_id, rn
+"""
+
+# 顧客ごとに解析する営業メモの最大件数
+SALES_NOTES_PER_CUSTOMER_LIMIT = 5
+
+# 解析対象の営業メモの最大件数（1件ごとにLLM解析を行うため上限を設ける）
+SALES_NOTES_LIMIT = 50
+
+# この件数以下の予測結果はLLMを使わずテンプレートで整形
+TEMPLATE_FORMAT_LIMIT = 3
+
+# 営業メモ解析のLLM同時呼び出し数（Bedrock のレート制限を超えないよう制限）
+ANALYSIS_CONCURRENCY = 8
+
+# LLM標準化結果（顧客ID抽出）のキャッシュ（入力文字列ごと、1時間）
+_standardize_cache = TTLCache(ttl=3600.0, maxsize=512)
 
 async def predict_cash_inflow_from_sales_notes(params: Dict[str, Any]) -> MCPResponse:
     """営業メモから入金予測を抽出"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     
-    print(f"[predict_cash_inflow_from_sales_notes] === FUNCTION START ===")
-    print(f"[predict_cash_inflow_from_sales_notes] Received raw params: {params}")
+    logger.debug("[predict_cash_inflow_from_sales_notes] === FUNCTION START ===")
+    logger.debug("[predict_cash_inflow_from_sales_notes] Received raw params: %s", params)
     
     # Try外で初期化（エラー時情報保持）
     tool_debug = {
@@ -34,9 +77,12 @@ async def predict_cash_inflow_from_sales_notes(params: Dict[str, Any]) -> MCPRes
     }
     
     try:
+        # LLM入力（dict の repr ではなく正規化した文字列を使い、キャッシュキーを安定させる）
+        raw_input = canonical_input(params)
+        
         # 引数標準化処理（参照渡し）
-        standardized_params = await standardize_cash_inflow_prediction_arguments(str(params), tool_debug)
-        print(f"[predict_cash_inflow_from_sales_notes] Standardized params: {standardized_params}")
+        standardized_params = await standardize_cash_inflow_prediction_arguments(raw_input, tool_debug)
+        logger.debug("[predict_cash_inflow_from_sales_notes] Standardized params: %s", standardized_params)
         
         customer_ids = standardized_params.get("customer_ids", [])
         
@@ -44,40 +90,51 @@ async def predict_cash_inflow_from_sales_notes(params: Dict[str, Any]) -> MCPRes
         predictions = await execute_cash_inflow_prediction_logic(customer_ids, tool_debug)
         
         # 結果フォーマット処理（参照渡し）
-        result_text = await format_cash_inflow_prediction_results(predictions, str(params), tool_debug)
+        result_text = await format_cash_inflow_prediction_results(predictions, tool_debug)
         
-        execution_time = time.time() - start_time
+        execution_time = time.perf_counter() - start_time
         tool_debug["execution_time_ms"] = round(execution_time * 1000, 2)
         tool_debug["results_count"] = len(predictions)
         
-        print(f"[predict_cash_inflow_from_sales_notes] Returning result with {len(predictions)} predictions")
-        print(f"[predict_cash_inflow_from_sales_notes] === FUNCTION END ===")
+        logger.debug("[predict_cash_inflow_from_sales_notes] Returning result with %s predictions", len(predictions))
+        logger.debug("[predict_cash_inflow_from_sales_notes] === FUNCTION END ===")
         
         return MCPResponse(result=result_text, debug_response=tool_debug)
         
     except Exception as e:
-        execution_time = time.time() - start_time
+        execution_time = time.perf_counter() - start_time
         error_message = f"入金予測エラー: {str(e)}"
         
         tool_debug["execution_time_ms"] = round(execution_time * 1000, 2)
         tool_debug["results_count"] = 0
         
-        print(f"[predict_cash_inflow_from_sales_notes] ERROR: {error_message}")
-        print(f"[predict_cash_inflow_from_sales_notes] === FUNCTION END ===")
+        logger.error("[predict_cash_inflow_from_sales_notes] ERROR: %s", error_message)
+        logger.debug("[predict_cash_inflow_from_sales_notes] === FUNCTION END ===")
         
         return MCPResponse(result=error_message, debug_response=tool_debug, error=str(e))
 
 async def standardize_cash_inflow_prediction_arguments(raw_input: str, tool_debug: Dict) -> Dict[str, Any]:
     """入金予測の引数を標準化（LLMベース）"""
-    print(f"[standardize_cash_inflow_prediction_arguments] Raw input: {raw_input}")
+    logger.debug("[standardize_cash_inflow_prediction_arguments] Raw input: %s", raw_input)
+    
+    # 同一入力のLLM標準化結果を再利用
+    cache_key = raw_input.strip()
+    cached = _standardize_cache.get(cache_key)
+    if cached is not None:
+        standardized_params, response, full_prompt_text = cached
+        tool_debug["standardize_prompt"] = full_prompt_text
+        tool_debug["standardize_response"] = response
+        tool_debug["standardize_parameter"] = str(standardized_params)
+        return dict(standardized_params)
     
     # データベースからシステムプロンプト取得
     system_prompt = await get_system_prompt("cash_inflow_prediction_pre")
     
-    print(f"[standardize_cash_inflow_prediction_arguments] === LLM CALL START ===")
-    response = await llm_util.call_claude(system_prompt, raw_input)
-    print(f"[standardize_cash_inflow_prediction_arguments] LLM Raw Response: {response}")
-    print(f"[standardize_cash_inflow_prediction_arguments] === LLM CALL END ===")
+    logger.debug("[standardize_cash_inflow_prediction_arguments] === LLM CALL START ===")
+    response = await llm_util.call_claude(system_prompt, raw_input, max_tokens=STANDARDIZE_MAX_TOKENS, model_id=STANDARDIZE_MODEL_ID,
+                                          latency=STANDARDIZE_LATENCY)
+    logger.debug("[standardize_cash_inflow_prediction_arguments] LLM Raw Response: %s", response)
+    logger.debug("[standardize_cash_inflow_prediction_arguments] === LLM CALL END ===")
     
     full_prompt_text = f"{system_prompt}\n\nUser Input: {raw_input}"
     
@@ -86,12 +143,13 @@ async def standardize_cash_inflow_prediction_arguments(raw_input: str, tool_debu
     tool_debug["standardize_response"] = response
     
     try:
-        standardized_params = json.loads(response)
-        print(f"[standardize_cash_inflow_prediction_arguments] Final Standardized Output: {standardized_params}")
+        standardized_params = orjson.loads(response)
+        logger.debug("[standardize_cash_inflow_prediction_arguments] Final Standardized Output: %s", standardized_params)
         tool_debug["standardize_parameter"] = str(standardized_params)
-        return standardized_params
-    except json.JSONDecodeError as e:
-        print(f"[standardize_cash_inflow_prediction_arguments] JSON parse error: {e}")
+        _standardize_cache.set(cache_key, (standardized_params, response, full_prompt_text))
+        return dict(standardized_params)
+    except orjson.JSONDecodeError as e:
+        logger.error("[standardize_cash_inflow_prediction_arguments] JSON parse error: %s", e)
         tool_debug["standardize_parameter"] = f"JSONパースエラー: {str(e)}"
         return {"customer_ids": []}
 
@@ -99,99 +157,56 @@ async def execute_cash_inflow_prediction_logic(customer_ids: List[int], tool_deb
     """営業メモ取得→LLMループ解析→入金予測抽出"""
     
     if not customer_ids:
-        print("[execute_cash_inflow_prediction_logic] No customer IDs provided")
+        logger.debug("[execute_cash_inflow_prediction_logic] No customer IDs provided")
         tool_debug["customers_analyzed"] = 0
         tool_debug["llm_analysis_calls"] = 0
         tool_debug["predictions_found"] = 0
         return []
     
-    # データベース接続・営業メモ取得
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    # asyncpgは型を暗黙変換しないため整数に正規化
+    customer_ids = [int(customer_id) for customer_id in customer_ids]
     
-    # 顧客IDリストでクエリ構築
-    placeholders = ','.join(['%s'] * len(customer_ids))
-    query = f"""
-    SELECT c.customer_id, c.name, sn.content as sales_note
-    FROM customers c 
-    JOIN sales_notes sn ON c.customer_id = sn.customer_id 
-    WHERE c.customer_id IN ({placeholders})
-    ORDER BY c.customer_id
-    """
+    query = SALES_NOTES_QUERY
     
-    print(f"[execute_cash_inflow_prediction_logic] Query: {query}")
-    print(f"[execute_cash_inflow_prediction_logic] Customer IDs: {customer_ids}")
+    logger.debug("[execute_cash_inflow_prediction_logic] Query: %s", query)
+    logger.debug("[execute_cash_inflow_prediction_logic] Customer IDs: %s", customer_ids)
     
     # tool_debugにクエリ情報設定
     tool_debug["executed_query"] = query
     
-    cursor.execute(query, customer_ids)
-    customers_with_notes = cursor.fetchall()
-    conn.close()
-    
-    print(f"[execute_cash_inflow_prediction_logic] Found {len(customers_with_notes)} customers with sales notes")
-    
-    # 営業メモ解析用システムプロンプト取得
-    analysis_prompt = await get_system_prompt("cash_inflow_prediction_analysis")
-    
-    predictions = []
-    individual_analysis = []
-    llm_calls = 0
-    predictions_found = 0
-    
-    # 各顧客の営業メモをLLMで解析
-    for customer in customers_with_notes:
-        print(f"[execute_cash_inflow_prediction_logic] Analyzing customer {customer['customer_id']}: {customer['name']}")
-        
-        try:
-            # LLMで営業メモ解析
-            prediction_response = await llm_util.call_claude(analysis_prompt, customer['sales_note'])
-            llm_calls += 1
-            
-            print(f"[execute_cash_inflow_prediction_logic] LLM Response for customer {customer['customer_id']}: {prediction_response}")
-            
-            # JSON解析
-            parsed_prediction = json.loads(prediction_response)
-            
-            # 個別解析結果保存
-            individual_analysis.append({
-                "customer_id": customer['customer_id'],
-                "customer_name": customer['name'],
-                "llm_response": prediction_response,
-                "parsed_amount": parsed_prediction.get("amount"),
-                "parsed_date": parsed_prediction.get("date")
-            })
-            
-            # 予測データ構築
-            prediction_data = {
-                "customer_id": customer['customer_id'],
-                "customer_name": customer['name'],
-                "predicted_amount": parsed_prediction.get("amount"),
-                "predicted_date": parsed_prediction.get("date")
-            }
-            
-            predictions.append(prediction_data)
-            
-            # 予測が見つかった場合のカウント
-            if parsed_prediction.get("amount") is not None:
-                predictions_found += 1
-                
-        except Exception as e:
-            print(f"[execute_cash_inflow_prediction_logic] Error analyzing customer {customer['customer_id']}: {e}")
-            
-            # エラー時も結果に含める
-            individual_analysis.append({
-                "customer_id": customer['customer_id'],
-                "customer_name": customer['name'],
-                "error": str(e)
-            })
-            
-            predictions.append({
-                "customer_id": customer['customer_id'],
-                "customer_name": customer['name'],
-                "predicted_amount": None,
-                "predicted_date": None
-            })
+    # 営業メモ解析用システムプロンプトはDB検索と並行して取得
+    analysis_prompt_task = asyncio.create_task(get_system_prompt("cash_inflow_prediction_analysis"))
+    
+    try:
+        # データベース接続・営業メモ取得（プールから接続取得）
+        async with get_db_connection() as conn:
+            customers_with_notes = await conn.fetch(query, customer_ids, SALES_NOTES_PER_CUSTOMER_LIMIT, SALES_NOTES_LIMIT)
+    except BaseException:
+        # DB検索が失敗した場合にプロンプト取得を残さない
+        analysis_prompt_task.cancel()
+        raise
+    
+    # 条件に合う営業メモの総数より取得件数が少なければ打ち切りあり（全体の上限で顧客ごと漏れた場合も含む）
+    notes_total = customers_with_notes[0]["notes_total"] if customers_with_notes else 0
+    tool_debug["truncated"] = notes_total > len(customers_with_notes)
+    
+    logger.debug("[execute_cash_inflow_prediction_logic] Found %s customers with sales notes", len(customers_with_notes))
+    
+    # 営業メモ解析用システムプロンプト取得（DB検索と並行して取得済み）
+    analysis_prompt = await analysis_prompt_task
+    
+    # 各顧客の営業メモをLLMで並行解析（顧客ごとに (個別解析結果, 予測データ, LLM呼び出し成否) を得る、結果は取得順）
+    semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+    
+    async def analyze_bounded(customer):
+        async with semaphore:
+            return await analyze_customer_sales_note(customer, analysis_prompt)
+    
+    analyzed = await asyncio.gather(*(analyze_bounded(customer) for customer in customers_with_notes))
+    individual_analysis = [analysis for analysis, _, _ in analyzed]
+    predictions = [prediction for _, prediction, _ in analyzed]
+    llm_calls = sum(1 for _, _, llm_called in analyzed if llm_called)
+    predictions_found = sum(1 for prediction in predictions if prediction["predicted_amount"] is not None)
     
     # tool_debugに統計情報設定
     tool_debug["customers_analyzed"] = len(customers_with_notes)
@@ -202,17 +217,91 @@ async def execute_cash_inflow_prediction_logic(customer_ids: List[int], tool_deb
     
     return predictions
 
-async def format_cash_inflow_prediction_results(predictions: list, user_input: str, tool_debug: Dict) -> str:
-    """入金予測結果をテキスト化"""
+async def analyze_customer_sales_note(customer, analysis_prompt: str) -> Tuple[Dict, Dict, bool]:
+    """1顧客の営業メモをLLMで解析し、(個別解析結果, 予測データ, LLM呼び出し成否) を返す"""
+    logger.debug("[execute_cash_inflow_prediction_logic] Analyzing customer %s: %s", customer['customer_id'], customer['name'])
+    
+    # 空・空白のみの営業メモはLLMを呼ばずに予測なしとする（「来月入金」のような短いメモは解析対象）
+    sales_note = customer['sales_note']
+    if not sales_note or not sales_note.strip():
+        return {
+            "customer_id": customer['customer_id'],
+            "customer_name": customer['name'],
+            "skipped": "営業メモが空のため解析省略"
+        }, {
+            "customer_id": customer['customer_id'],
+            "customer_name": customer['name'],
+            "predicted_amount": None,
+            "predicted_date": None
+        }, False
+    
+    llm_called = False
+    try:
+        # LLMで営業メモ解析
+        prediction_response = await llm_util.call_claude(analysis_prompt, customer['sales_note'])
+        llm_called = True
+        
+        logger.debug("[execute_cash_inflow_prediction_logic] LLM Response for customer %s: %s", customer['customer_id'], prediction_response)
+        
+        # JSON解析
+        parsed_prediction = orjson.loads(prediction_response)
+        
+        # 個別解析結果・予測データ構築
+        return {
+            "customer_id": customer['customer_id'],
+            "customer_name": customer['name'],
+            "llm_response": prediction_response,
+            "parsed_amount": parsed_prediction.get("amount"),
+            "parsed_date": parsed_prediction.get("date")
+        }, {
+            "customer_id": customer['customer_id'],
+            "customer_name": customer['name'],
+            "predicted_amount": parsed_prediction.get("amount"),
+            "predicted_date": parsed_prediction.get("date")
+        }, llm_called
+        
+    except Exception as e:
+        logger.error("[execute_cash_inflow_prediction_logic] Error analyzing customer %s: %s", customer['customer_id'], e)
+        
+        # エラー時も結果に含める
+        return {
+            "customer_id": customer['customer_id'],
+            "customer_name": customer['name'],
+            "error": str(e)
+        }, {
+            "customer_id": customer['customer_id'],
+            "customer_name": customer['name'],
+            "predicted_amount": None,
+            "predicted_date": None
+        }, llm_called
+
+async def format_cash_inflow_prediction_results(predictions: list, tool_debug: Dict) -> str:
+    """入金予測結果をテキスト化（営業メモを上限で打ち切った場合はその旨を末尾に付記）"""
+    result_text = await _format_predictions(predictions, tool_debug)
+    if tool_debug.get("truncated"):
+        result_text += (f"\n\n※ 営業メモが多いため、顧客ごとに最大{SALES_NOTES_PER_CUSTOMER_LIMIT}件"
+                        f"（全体で{SALES_NOTES_LIMIT}件まで）を解析しています。")
+        tool_debug["format_response"] = result_text
+    return result_text
+
+async def _format_predictions(predictions: list, tool_debug: Dict) -> str:
+    """入金予測結果をテキスト化（少数件はテンプレート、それ以外はLLM）"""
     
     if not predictions:
         return "入金予測分析結果: 該当する顧客の営業メモが見つかりませんでした。"
     
+    # 予測が1件もない場合・少数の顧客はLLMを呼ばずにテンプレートで整形（予測は営業メモ単位のため顧客数で判定）
+    customer_count = len({p["customer_id"] for p in predictions})
+    if customer_count <= TEMPLATE_FORMAT_LIMIT or all(p["predicted_amount"] is None for p in predictions):
+        result_text = render_predictions_text(predictions)
+        tool_debug["format_response"] = result_text
+        return result_text
+    
     # データベースからシステムプロンプト取得
     system_prompt = await get_system_prompt("cash_inflow_prediction_post")
     
     # データJSON化
-    data_json = json.dumps(predictions, ensure_ascii=False, default=str, indent=2)
+    data_json = orjson.dumps(predictions, default=json_default, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
     full_prompt = f"{system_prompt}\n\nData:\n{data_json}"
     
     # tool_debugにformat_request設定
@@ -220,10 +309,30 @@ async def format_cash_inflow_prediction_results(predictions: list, user_input: s
     
     # LLM呼び出し
     result_text, execution_time = await llm_util.call_llm_simple(full_prompt)
-    print(f"[format_cash_inflow_prediction_results] Execution time: {execution_time}ms")
-    print(f"[format_cash_inflow_prediction_results] Formatted result: {result_text[:200]}...")
+    logger.debug("[format_cash_inflow_prediction_results] Execution time: %sms", execution_time)
+    logger.debug("[format_cash_inflow_prediction_results] Formatted result: %.200s...", result_text)
     
     # tool_debugにformat_response設定
     tool_debug["format_response"] = result_text
     
     return result_text
+
+def render_predictions_text(predictions: list) -> str:
+    """入金予測結果をテンプレートで整形（予測は営業メモ単位のため顧客ごとにまとめる）"""
+    by_customer: Dict[Any, List[Dict]] = {}
+    for p in predictions:
+        by_customer.setdefault(p["customer_id"], []).append(p)
+    found = {
+        customer_id: [p for p in customer_predictions if p["predicted_amount"] is not None]
+        for customer_id, customer_predictions in by_customer.items()
+    }
+    found = {customer_id: items for customer_id, items in found.items() if items}
+    summary = f"{len(by_customer)}名（営業メモ{len(predictions)}件）"
+    if not found:
+        return f"入金予測分析結果: {summary}から入金予測は見つかりませんでした。"
+    
+    lines = [f"入金予測分析結果: {summary}中{len(found)}名に入金予測があります。"]
+    for customer_id, items in found.items():
+        details = "、".join(f"予測金額 {p['predicted_amount']} / 予測時期 {p['predicted_date'] or '不明'}" for p in items)
+        lines.append(f"- {items[0]['customer_name']}（顧客ID: {customer_id}）: {details}")
+    return "\n".join(lines)
@@ -1,20 +1,81 @@
 # Customer holdings tool
 
+import re
 import time
-import json
-from typing import Dict, Any, Tuple, List
+import asyncio
+import orjson
+import logging
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Awaitable
 from utils.database import get_db_connection
+from utils.cache import TTLCache
 from utils.system_prompt import get_system_prompt
-from utils.llm_util import llm_util
+from utils.llm_util import llm_util, STANDARDIZE_MAX_TOKENS, STANDARDIZE_MODEL_ID, STANDARDIZE_LATENCY
+from utils.json_util import canonical_input, json_default
 from models import MCPResponse
-from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+# 保有商品取得クエリ（顧客IDは配列1パラメータで渡し、SQL文字列を固定）
+# 数値・日付の変換はSQL側で行い、列順はレスポンスの項目順に合わせる
+# 件数上限は顧客ごとに適用し、複数顧客を1往復で取得しても顧客単位の呼び出しと同じ結果にする
+HOLDINGS_QUERY = """
+    SELECT h.holding_id, h.customer_id, c.name as customer_name,
+           p.product_code, p.product_name, p.category_code,
+           COALESCE(h.quantity, 0)::float8 AS quantity,
+           COALESCE(h.unit_price, 0)::float8 AS unit_price,
+           COALESCE(h.current_price, 0)::float8 AS current_price,
+           COALESCE(h.current_value, 0)::float8 AS current_value,
+           p.currency,
+           to_char(h.purchase_date, 'YYYY-MM-DD') AS purchase_date
+    FROM (
+        SELECT h.*,
+               row_number() OVER (PARTITION BY h.customer_id ORDER BY h.current_value DESC NULLS LAST) AS rn
+        FROM holdings h
+        WHERE h.customer_id = ANY($1::int[])
+    ) h
+    JOIN products p ON h.product_id = p.product_id
+    JOIN customers c ON h.customer_id = c.customer_id
+    WHERE h.rn <= $2
+    ORDER BY h.customer_id, h.current_value DESC NULLS LAST
+"""
+
+# 顧客ごとの保有商品の最大取得件数（LLM整形への入力量とDB転送量の上限）
+HOLDINGS_LIMIT = 100
+
+# この件数以下の結果はLLMを使わずテンプレートで整形
+TEMPLATE_FORMAT_LIMIT = 3
+
+# 接続確立時のウォームアップ用引数（顧客IDなしで0件を返す）
+HOLDINGS_WARMUP = (HOLDINGS_QUERY, ([], HOLDINGS_LIMIT))
+
+# 保有商品クエリ結果のキャッシュ（同一顧客の短時間の再照会でDBを叩かない）
+_holdings_cache = TTLCache(ttl=60.0, maxsize=256)
+
+# LLM標準化結果（顧客ID抽出）のキャッシュ（入力文字列ごと、1時間）
+_standardize_cache = TTLCache(ttl=3600.0, maxsize=512)
+
+# ルールベース標準化用パターン（「123」「1, 2, 3」「顧客ID: 5」「customer_id 7」のように顧客IDだけの入力）
+_CUSTOMER_IDS_PATTERN = re.compile(
+    r"^\s*(?:(?:顧客|customer)[\s_]*(?:ID|番号)?\s*[:：]?\s*)?(\d+(?:\s*[,、，\s]\s*\d+)*)\s*$",
+    re.IGNORECASE
+)
+
+def _parse_customer_ids(raw_input: str) -> Optional[List[int]]:
+    """顧客IDのみの入力をLLMなしで抽出（判定できなければ None）"""
+    match = _CUSTOMER_IDS_PATTERN.match(raw_input)
+    if match is None:
+        return None
+    return list(dict.fromkeys(int(customer_id) for customer_id in re.findall(r"\d+", match.group(1))))
 
 async def get_customer_holdings(params: Dict[str, Any]) -> MCPResponse:
     """顧客の保有商品情報を取得"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     
-    print(f"[get_customer_holdings] === FUNCTION START ===")
-    print(f"[get_customer_holdings] Received raw params: {params}")
+    logger.debug("[get_customer_holdings] === FUNCTION START ===")
+    logger.debug("[get_customer_holdings] Received raw params: %s", params)
     
     # デバッグ情報インスタンス（try外側で定義）
     tool_debug = {
@@ -31,29 +92,38 @@ async def get_customer_holdings(params: Dict[str, Any]) -> MCPResponse:
         "results_count": 0
     }
     
+    # 先行取得中の整形用プロンプト（テンプレート整形・例外時は finally で取り消す）
+    post_prompt_task = None
+    
     try:
+        # LLM入力（dict の repr ではなく正規化した文字列を使い、キャッシュキーを安定させる）
+        raw_input = canonical_input(params)
+        
         # 引数標準化処理（顧客ID抽出）
-        await standardize_customer_arguments(str(params), tool_debug)
+        await standardize_customer_arguments(raw_input, tool_debug)
         
         if not tool_debug.get("customer_ids"):
             tool_debug["error"] = "顧客ID抽出失敗"
-            tool_debug["execution_time_ms"] = round((time.time() - start_time) * 1000, 2)
+            tool_debug["execution_time_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
             
             return MCPResponse(
                 result="顧客特定不可のため実行できませんでした",
                 debug_response=tool_debug
             )
         
+        # 整形用システムプロンプトはDB検索と並行して取得
+        post_prompt_task = asyncio.create_task(get_system_prompt('get_customer_holdings_post'))
+        
         # データベースクエリ実行
         await execute_holdings_query(tool_debug)
         
         # 結果テキスト化
-        await format_customer_holdings_results(tool_debug)
+        await format_customer_holdings_results(tool_debug, post_prompt_task)
         
-        tool_debug["execution_time_ms"] = round((time.time() - start_time) * 1000, 2)
+        tool_debug["execution_time_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
         
-        print(f"[get_customer_holdings] Returning result with {tool_debug['results_count']} holdings")
-        print(f"[get_customer_holdings] === FUNCTION END ===")
+        logger.debug("[get_customer_holdings] Returning result with %s holdings", tool_debug['results_count'])
+        logger.debug("[get_customer_holdings] === FUNCTION END ===")
         
         return MCPResponse(
             result=tool_debug["format_response"], 
@@ -63,19 +133,42 @@ async def get_customer_holdings(params: Dict[str, Any]) -> MCPResponse:
     except Exception as e:
         tool_debug["error"] = str(e)
         tool_debug["error_type"] = type(e).__name__
-        tool_debug["execution_time_ms"] = round((time.time() - start_time) * 1000, 2)
+        tool_debug["execution_time_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
         
-        print(f"[get_customer_holdings] Error: {e}")
-        print(f"[get_customer_holdings] === FUNCTION END (ERROR) ===")
+        logger.error("[get_customer_holdings] Error: %s", e)
+        logger.debug("[get_customer_holdings] === FUNCTION END (ERROR) ===")
         
         return MCPResponse(
             result=f"顧客保有商品取得エラー: {str(e)}", 
             debug_response=tool_debug
         )
+    finally:
+        # 使われなかったプロンプト取得（0件・少数件のテンプレート整形・エラー時）を残さない
+        if post_prompt_task is not None and not post_prompt_task.done():
+            post_prompt_task.cancel()
 
 async def standardize_customer_arguments(raw_input: str, tool_debug: dict) -> None:
-    """顧客検索の引数を標準化（LLMベース）- 参照渡し"""
-    print(f"[standardize_customer_arguments] Raw input: {raw_input}")
+    """顧客検索の引数を標準化（顧客IDのみの入力はルールベース、それ以外はLLM）- 参照渡し"""
+    logger.debug("[standardize_customer_arguments] Raw input: %s", raw_input)
+    
+    # 顧客IDのみの入力はLLMを呼ばずに標準化
+    customer_ids = _parse_customer_ids(raw_input)
+    if customer_ids:
+        tool_debug["standardize_response"] = "rule-based"
+        tool_debug["customer_ids"] = customer_ids
+        tool_debug["standardize_parameter"] = str(customer_ids)
+        return
+    
+    # 同一入力のLLM標準化結果を再利用
+    cache_key = raw_input.strip()
+    cached = _standardize_cache.get(cache_key)
+    if cached is not None:
+        customer_ids, response, full_prompt = cached
+        tool_debug["standardize_prompt"] = full_prompt
+        tool_debug["standardize_response"] = response
+        tool_debug["customer_ids"] = list(customer_ids)
+        tool_debug["standardize_parameter"] = str(tool_debug["customer_ids"])
+        return
     
     # データベースからシステムプロンプト取得
     system_prompt = await get_system_prompt("get_customer_holdings_pre")
@@ -84,95 +177,87 @@ async def standardize_customer_arguments(raw_input: str, tool_debug: dict) -> No
     full_prompt = f"{system_prompt}\n\nUser Input: {raw_input}"
     tool_debug["standardize_prompt"] = full_prompt
     
-    # call_llm_simple使用（統一）
-    response, execution_time = await llm_util.call_llm_simple(full_prompt)
+    # call_claude使用（system + user分離、静的な system プロンプトを Bedrock のプロンプトキャッシュ対象にする）
+    llm_start = time.perf_counter()
+    response = await llm_util.call_claude(system_prompt, raw_input, max_tokens=STANDARDIZE_MAX_TOKENS, model_id=STANDARDIZE_MODEL_ID,
+                                          latency=STANDARDIZE_LATENCY)
+    execution_time = (time.perf_counter() - llm_start) * 1000
     tool_debug["standardize_response"] = response
     
-    print(f"[standardize_customer_arguments] LLM Raw Response: {response}")
-    print(f"[standardize_customer_arguments] Execution time: {execution_time}ms")
+    logger.debug("[standardize_customer_arguments] LLM Raw Response: %s", response)
+    logger.debug("[standardize_customer_arguments] Execution time: %sms", execution_time)
     
     try:
-        customer_ids = json.loads(response)
+        customer_ids = orjson.loads(response)
         if not isinstance(customer_ids, list):
             customer_ids = []
         
         tool_debug["customer_ids"] = customer_ids
         tool_debug["standardize_parameter"] = str(customer_ids)
+        if customer_ids:
+            _standardize_cache.set(cache_key, (tuple(customer_ids), response, full_prompt))
         
-        print(f"[standardize_customer_arguments] Final Customer IDs: {customer_ids}")
+        logger.debug("[standardize_customer_arguments] Final Customer IDs: %s", customer_ids)
         
-    except json.JSONDecodeError as e:
-        print(f"[standardize_customer_arguments] JSON parse error: {e}")
+    except orjson.JSONDecodeError as e:
+        logger.error("[standardize_customer_arguments] JSON parse error: %s", e)
         tool_debug["customer_ids"] = []
         tool_debug["standardize_parameter"] = f"LLM応答のJSONパース失敗: {str(e)}"
 
 async def execute_holdings_query(tool_debug: dict) -> None:
     """データベースクエリ実行 - 参照渡し"""
-    customer_ids = tool_debug["customer_ids"]
-    
-    # データベース接続・クエリ実行
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    # OR条件でSQL構築
-    placeholders = ",".join(["%s"] * len(customer_ids))
-    query = f"""
-    SELECT h.holding_id, h.quantity, h.unit_price, h.current_price, h.current_value,
-           h.purchase_date, h.customer_id,
-           p.product_code, p.product_name, p.category_code, p.currency,
-           c.name as customer_name
-    FROM holdings h
-    JOIN products p ON h.product_id = p.product_id
-    JOIN customers c ON h.customer_id = c.customer_id
-    WHERE h.customer_id IN ({placeholders})
-    ORDER BY h.customer_id, h.current_value DESC
-    """
+    # asyncpgは型を暗黙変換しないため整数に正規化
+    customer_ids = [int(customer_id) for customer_id in tool_debug["customer_ids"]]
+    
+    query = HOLDINGS_QUERY
     
     tool_debug["executed_query"] = query
     
-    print(f"[execute_holdings_query] Final query: {query}")
-    print(f"[execute_holdings_query] Customer IDs: {customer_ids}")
-    
-    cursor.execute(query, customer_ids)
-    results = cursor.fetchall()
-    conn.close()
-    
-    print(f"[execute_holdings_query] Query executed, found {len(results)} holdings")
-    
-    # 結果配列作成
-    holdings = []
-    for row in results:
-        holdings.append({
-            "holding_id": row['holding_id'],
-            "customer_id": row['customer_id'],
-            "customer_name": row['customer_name'],
-            "product_code": row['product_code'],
-            "product_name": row['product_name'],
-            "category_code": row['category_code'],
-            "quantity": float(row['quantity']) if row['quantity'] else 0,
-            "unit_price": float(row['unit_price']) if row['unit_price'] else 0,
-            "current_price": float(row['current_price']) if row['current_price'] else 0,
-            "current_value": float(row['current_value']) if row['current_value'] else 0,
-            "currency": row['currency'],
-            "purchase_date": row['purchase_date'].isoformat() if row['purchase_date'] else None
-        })
+    logger.debug("[execute_holdings_query] Final query: %s", query)
+    logger.debug("[execute_holdings_query] Customer IDs: %s", customer_ids)
+    
+    # キャッシュキーは顧客IDの順序・重複に依存しない形にする
+    cache_key = tuple(sorted(set(customer_ids)))
+    holdings = _holdings_cache.get(cache_key)
+    tool_debug["cache_hit"] = holdings is not None
+    
+    if holdings is None:
+        # データベース接続・クエリ実行（プールから接続取得）
+        async with get_db_connection() as conn:
+            results = await conn.fetch(query, customer_ids, HOLDINGS_LIMIT)
+        
+        logger.debug("[execute_holdings_query] Query executed, found %s holdings", len(results))
+        
+        # 結果配列作成
+        holdings = [dict(row) for row in results]
+        _holdings_cache.set(cache_key, holdings)
+    
+    # 顧客ごとの件数を1パスで集計
+    counts_by_customer = Counter(holding["customer_id"] for holding in holdings)
     
     tool_debug["executed_query_results"] = holdings
     tool_debug["results_count"] = len(holdings)
+    tool_debug["results_count_by_customer"] = dict(counts_by_customer)
+    tool_debug["truncated"] = any(count >= HOLDINGS_LIMIT for count in counts_by_customer.values())
 
-async def format_customer_holdings_results(tool_debug: dict) -> None:
-    """顧客保有商品結果をテキスト化 - 参照渡し"""
+async def format_customer_holdings_results(tool_debug: dict, system_prompt_task: Awaitable[str]) -> None:
+    """顧客保有商品結果をテキスト化（システムプロンプトは取得中のタスクを受け取る）- 参照渡し"""
     holdings = tool_debug["executed_query_results"]
     
     if not holdings:
         tool_debug["format_response"] = "保有商品検索結果: 該当する保有商品はありませんでした。"
         return
     
-    # システムプロンプト取得
-    system_prompt = await get_system_prompt('get_customer_holdings_post')
+    # 少数件はLLMを呼ばずにテンプレートで整形
+    if len(holdings) <= TEMPLATE_FORMAT_LIMIT:
+        tool_debug["format_response"] = render_holdings_text(holdings)
+        return
+    
+    # システムプロンプト取得（DB検索と並行して取得済み）
+    system_prompt = await system_prompt_task
     
     # 呼び出し元でデータ結合（責任明確化）
-    data_json = json.dumps(holdings, ensure_ascii=False, default=str, indent=2)
+    data_json = orjson.dumps(holdings, default=json_default, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
     full_prompt = f"{system_prompt}\n\nData:\n{data_json}"
     
     # 完全プロンプトでLLM呼び出し
@@ -180,5 +265,20 @@ async def format_customer_holdings_results(tool_debug: dict) -> None:
     
     tool_debug["format_response"] = result_text
     
-    print(f"[format_customer_holdings_results] Execution time: {execution_time}ms")
-    print(f"[format_customer_holdings_results] Formatted result: {result_text[:200]}...")
+    logger.debug("[format_customer_holdings_results] Execution time: %sms", execution_time)
+    logger.debug("[format_customer_holdings_results] Formatted result: %.200s...", result_text)
+
+def render_holdings_text(holdings: list) -> str:
+    """保有商品一覧をテンプレートで整形（結果は顧客ID順に並んでいる前提）"""
+    lines = ["保有商品検索結果:"]
+    for customer_id, rows in groupby(holdings, key=itemgetter("customer_id")):
+        rows = list(rows)
+        lines.append(f"■ {rows[0]['customer_name']}（顧客ID: {customer_id}）")
+        for row in rows:
+            currency = f" {row['currency']}" if row["currency"] else ""
+            lines.append(
+                f"- {row['product_name']}（{row['product_code']}）"
+                f" 数量: {row['quantity']:,.0f} / 評価額: {row['current_value']:,.0f}{currency}"
+                f" / 購入日: {row['purchase_date'] or '不明'}"
+            )
+    return "\n".join(lines)
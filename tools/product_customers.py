@@ -3,13 +3,67 @@
 テキストから商品IDを抽出し、該当商品の保有顧客リストを返す
 """
 
-import json
+import orjson
 import time
+import asyncio
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
 from utils.database import get_db_connection
-from utils.llm_util import llm_util
+from utils.cache import TTLCache
+from utils.llm_util import llm_util, STANDARDIZE_MAX_TOKENS, STANDARDIZE_MODEL_ID, STANDARDIZE_LATENCY
 from utils.system_prompt import get_system_prompt
+from utils.json_util import json_default, to_flag
+from utils.debug_context import is_full_debug
 from models import MCPResponse
 
+# 商品保有顧客取得クエリ（商品IDは配列1パラメータで渡し、SQL文字列を固定）
+# Decimal→float 変換はSQL側で行う
+# 件数上限は商品ごとに評価額の大きい順で適用（保有者の多い商品でも全行を転送・保持しない）
+PRODUCT_CUSTOMERS_QUERY = """
+    SELECT h.product_id, p.product_name, h.customer_id, c.name, 
+           h.quantity::float8 AS quantity, h.current_value::float8 AS current_value
+    FROM (
+        SELECT h.*,
+               row_number() OVER (PARTITION BY h.product_id ORDER BY h.current_value DESC NULLS LAST) AS rn
+        FROM holdings h
+        WHERE h.product_id = ANY($1::int[])
+    ) h 
+    JOIN customers c ON h.customer_id = c.customer_id 
+    JOIN products p ON h.product_id = p.product_id
+    WHERE h.rn <= $2
+    ORDER BY h.product_id, h.current_value DESC NULLS LAST
+"""
+
+# 商品ごとの保有顧客の最大取得件数（LLM整形への入力量とDB転送量の上限）
+PRODUCT_CUSTOMERS_LIMIT = 200
+
+# debug_response に載せる検索結果の最大件数
+DEBUG_RESULTS_LIMIT = 20
+
+# この件数以下の結果はLLMを使わずテンプレートで整形
+TEMPLATE_FORMAT_LIMIT = 3
+
+# 商品ID抽出用のツール定義（ツール指定で呼び出し、応答テキストのJSON解析を不要にする）
+EXTRACT_PRODUCT_IDS_TOOL = {
+    "name": "emit_product_ids",
+    "description": "入力テキストから抽出した商品IDの一覧を返す",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "product_ids": {
+                "type": "array",
+                "items": {"type": "integer"},
+                "description": "抽出した商品ID（該当なしは空配列）"
+            }
+        },
+        "required": ["product_ids"]
+    }
+}
+
+# LLMによる商品ID抽出結果のキャッシュ（入力テキストごと、1時間）
+_extract_ids_cache = TTLCache(ttl=3600.0, maxsize=512)
+
 async def get_customers_by_product_text(text_input: str):
     """
     テキストから商品IDを抽出し、該当商品の保有顧客リストを返す
@@ -20,7 +74,7 @@ async def get_customers_by_product_text(text_input: str):
     Returns:
         MCPResponse: 結果とデバッグ情報
     """
-    start_total_time = time.time()
+    start_total_time = time.perf_counter()
     
     # Try外側でデバッグ情報初期化（推奨構造）
     debug_response = {
@@ -48,7 +102,20 @@ async def get_customers_by_product_text(text_input: str):
         "error": None
     }
     
+    # 先行取得中のプロンプト（早期リターン・例外時は finally で取り消す）
+    extract_prompt_task = format_prompt_task = None
+    
     try:
+        # format_output=false（ツール連携など顧客リストのみ必要な呼び出し）はLLM整形を省略
+        format_output = True
+        if isinstance(text_input, dict):
+            format_output = to_flag(text_input.get("format_output"), True)
+        
+        # STEP 1・STEP 3 のプロンプトは互いに独立しているため入口で並行して取得開始
+        # （整形用は STEP 1 の LLM 呼び出し・STEP 2 のSQL実行中に取得が完了する）
+        extract_prompt_task = asyncio.create_task(get_system_prompt("customer_by_product_extract_ids"))
+        format_prompt_task = asyncio.create_task(get_system_prompt("customer_by_product_format_results")) if format_output else None
+        
         # 呼び出し元責任：テキスト化処理
         if isinstance(text_input, dict):
             # 辞書の場合は適切な文字列を抽出
@@ -75,87 +142,91 @@ async def get_customers_by_product_text(text_input: str):
         debug_response["processed_input"] = text_input_str
         
         # STEP 1: ID抽出（LLM使用）
-        step1_start = time.time()
-        extract_prompt = await get_system_prompt("customer_by_product_extract_ids")
+        step1_start = time.perf_counter()
+        extract_prompt = await extract_prompt_task
         
-        # 呼び出し元責任：プロンプト結合
-        combined_request = f"{extract_prompt}\n\n入力テキスト: {text_input_str}"
-        debug_response["step1_extract_ids"]["llm_request"] = combined_request
+        # 呼び出し元責任：プロンプト結合（デバッグ表示専用のため全文出力時のみ）
+        if is_full_debug():
+            debug_response["step1_extract_ids"]["llm_request"] = f"{extract_prompt}\n\n入力テキスト: {text_input_str}"
         
-        # call_claude使用（system + user分離）
-        ids_response = await llm_util.call_claude(extract_prompt, text_input_str)
-        debug_response["step1_extract_ids"]["llm_response"] = ids_response
-        debug_response["step1_extract_ids"]["execution_time_ms"] = int((time.time() - step1_start) * 1000)
-        
-        product_ids = json.loads(ids_response)
+        # call_claude_tool使用（system + user分離、ツール指定で商品ID配列を直接受け取る）、同一入力は抽出結果を再利用
+        cache_key = text_input_str.strip()
+        product_ids = _extract_ids_cache.get(cache_key)
+        if product_ids is None:
+            ids_input = await llm_util.call_claude_tool(extract_prompt, text_input_str, EXTRACT_PRODUCT_IDS_TOOL,
+                                                        max_tokens=STANDARDIZE_MAX_TOKENS, model_id=STANDARDIZE_MODEL_ID,
+                                                        latency=STANDARDIZE_LATENCY)
+            debug_response["step1_extract_ids"]["llm_response"] = ids_input
+            product_ids = ids_input.get("product_ids") or []
+        debug_response["step1_extract_ids"]["execution_time_ms"] = int((time.perf_counter() - step1_start) * 1000)
         debug_response["step1_extract_ids"]["result"] = product_ids
         
         if not product_ids:
             debug_response["error"] = "商品IDが抽出されませんでした"
-            debug_response["total_execution_time_ms"] = int((time.time() - start_total_time) * 1000)
+            debug_response["total_execution_time_ms"] = int((time.perf_counter() - start_total_time) * 1000)
             return MCPResponse(
                 result="商品IDが抽出されませんでした",
                 error="商品IDが抽出されませんでした",
                 debug_response=debug_response
             )
         
+        _extract_ids_cache.set(cache_key, product_ids)
+        
         # STEP 2: SQL実行（LLM使用しない）
-        step2_start = time.time()
-        placeholders = ','.join(['%s'] * len(product_ids))
-        query = f"""
-            SELECT h.product_id, p.product_name, h.customer_id, c.name, 
-                   h.quantity, h.current_value
-            FROM holdings h 
-            JOIN customers c ON h.customer_id = c.customer_id 
-            JOIN products p ON h.product_id = p.product_id
-            WHERE h.product_id IN ({placeholders})
-            ORDER BY h.product_id, h.current_value DESC
-        """
+        step2_start = time.perf_counter()
+        # asyncpgは型を暗黙変換しないため整数に正規化
+        product_ids = [int(product_id) for product_id in product_ids]
+        query = PRODUCT_CUSTOMERS_QUERY
         debug_response["step2_sql_execution"]["sql_query"] = query
-        debug_response["step2_sql_execution"]["sql_parameters"] = product_ids
-        
-        # データベース接続・実行
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(query, product_ids)
-        
-        # 結果を辞書形式で取得（Decimal型をfloat型に変換）
-        columns = [desc[0] for desc in cursor.description]
-        raw_customers = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        # Decimal型をfloat型に変換してJSON serializable にする
-        customers = []
-        for customer in raw_customers:
-            converted_customer = {}
-            for key, value in customer.items():
-                if key in ['quantity', 'current_value'] and value is not None:
-                    converted_customer[key] = float(value)
-                else:
-                    converted_customer[key] = value
-            customers.append(converted_customer)
+        debug_response["step2_sql_execution"]["sql_parameters"] = [product_ids, PRODUCT_CUSTOMERS_LIMIT]
+        
+        # データベース接続・実行（プールから接続取得）
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(query, product_ids, PRODUCT_CUSTOMERS_LIMIT)
         
-        cursor.close()
-        conn.close()
+        # 結果を辞書形式で取得
+        customers = [dict(row) for row in rows]
+        counts_by_product = Counter(customer["product_id"] for customer in customers)
+        truncated = any(count >= PRODUCT_CUSTOMERS_LIMIT for count in counts_by_product.values())
         
-        debug_response["step2_sql_execution"]["execution_time_ms"] = int((time.time() - step2_start) * 1000)
-        debug_response["step2_sql_execution"]["result"] = customers
+        debug_response["step2_sql_execution"]["execution_time_ms"] = int((time.perf_counter() - step2_start) * 1000)
+        # 先頭のみ設定（全件は results_count で把握、レスポンスの肥大化を防ぐ）
+        debug_response["step2_sql_execution"]["result"] = customers[:DEBUG_RESULTS_LIMIT]
+        debug_response["results_count"] = len(customers)
+        debug_response["truncated"] = truncated
         
         # STEP 3: 結果整形（LLM使用）
-        step3_start = time.time()
-        format_prompt = await get_system_prompt("customer_by_product_format_results")
-        customers_json = json.dumps(customers, ensure_ascii=False)
+        step3_start = time.perf_counter()
+        
+        # 整形不要・少数件はLLMを呼ばずにテンプレートで整形
+        if not format_output or len(customers) <= TEMPLATE_FORMAT_LIMIT:
+            formatted_response = render_product_customers_text(customers)
+            debug_response["step3_format_results"]["skipped"] = "format_output=false" if not format_output else "テンプレート整形"
+            debug_response["step3_format_results"]["execution_time_ms"] = int((time.perf_counter() - step3_start) * 1000)
+            debug_response["step3_format_results"]["result"] = formatted_response
+            debug_response["total_execution_time_ms"] = int((time.perf_counter() - start_total_time) * 1000)
+            return MCPResponse(
+                result=formatted_response,
+                debug_response=debug_response
+            )
         
-        # 呼び出し元責任：プロンプト結合
-        combined_request = f"{format_prompt}\n\n入力データ: {customers_json}"
-        debug_response["step3_format_results"]["llm_request"] = combined_request
+        format_prompt = await format_prompt_task
+        customers_json = orjson.dumps(customers, default=json_default).decode()
+        if truncated:
+            # 上限で打ち切った場合は全件列挙ではなく要約を求める
+            customers_json += f"\n\n※ 保有顧客が多い商品は評価額の大きい上位{PRODUCT_CUSTOMERS_LIMIT}名のみを示しています。全件を列挙せず傾向と主な顧客を要約してください。"
+        
+        # 呼び出し元責任：プロンプト結合（デバッグ表示専用のため全文出力時のみ）
+        if is_full_debug():
+            debug_response["step3_format_results"]["llm_request"] = f"{format_prompt}\n\n入力データ: {customers_json}"
         
         # call_claude使用（system + user分離）
         formatted_response = await llm_util.call_claude(format_prompt, customers_json)
         debug_response["step3_format_results"]["llm_response"] = formatted_response
-        debug_response["step3_format_results"]["execution_time_ms"] = int((time.time() - step3_start) * 1000)
+        debug_response["step3_format_results"]["execution_time_ms"] = int((time.perf_counter() - step3_start) * 1000)
         debug_response["step3_format_results"]["result"] = formatted_response
         
-        debug_response["total_execution_time_ms"] = int((time.time() - start_total_time) * 1000)
+        debug_response["total_execution_time_ms"] = int((time.perf_counter() - start_total_time) * 1000)
         
         return MCPResponse(
             result=formatted_response,
@@ -164,9 +235,29 @@ async def get_customers_by_product_text(text_input: str):
         
     except Exception as e:
         debug_response["error"] = str(e)
-        debug_response["total_execution_time_ms"] = int((time.time() - start_total_time) * 1000)
+        debug_response["total_execution_time_ms"] = int((time.perf_counter() - start_total_time) * 1000)
         return MCPResponse(
             result=f"処理中にエラーが発生しました: {str(e)}",
             error=f"処理中にエラーが発生しました: {str(e)}",
             debug_response=debug_response
         )
+    finally:
+        # 使われなかったプロンプト取得（ID抽出なし・テンプレート整形・エラー時）を残さない
+        for task in (extract_prompt_task, format_prompt_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+def render_product_customers_text(customers: list) -> str:
+    """商品保有顧客一覧をテンプレートで整形（結果は商品ID順に並んでいる前提）"""
+    if not customers:
+        return "商品保有顧客検索結果: 該当する保有顧客はいませんでした。"
+    lines = ["商品保有顧客検索結果:"]
+    for product_id, rows in groupby(customers, key=itemgetter("product_id")):
+        rows = list(rows)
+        lines.append(f"■ {rows[0]['product_name']}（商品ID: {product_id}）保有顧客 {len(rows)}名")
+        for row in rows:
+            lines.append(
+                f"- {row['name']}（顧客ID: {row['customer_id']}）"
+                f" 数量: {row['quantity'] or 0:,.0f} / 評価額: {row['current_value'] or 0:,.0f}"
+            )
+    return "\n".join(lines)
@@ -1,47 +1,96 @@
-import httpx
-from typing import Dict, List, Any, Optional
+import time
+import logging
+import importlib
+import orjson
+from typing import Callable, Dict, List, Any, Optional
+from utils.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# ツール名 → (モジュール, 関数名) のディスパッチテーブル
+TOOL_FUNCTIONS = {
+    "search_customers_by_bond_maturity": ("tools.bond_maturity", "search_customers_by_bond_maturity"),
+    "get_customer_holdings": ("tools.customer_holdings", "get_customer_holdings"),
+    "predict_cash_inflow_from_sales_notes": ("tools.cash_inflow_prediction", "predict_cash_inflow_from_sales_notes"),
+    "get_customers_by_product_text": ("tools.product_customers", "get_customers_by_product_text")
+}
 
 class ToolsManager:
     """ツール定義の一元管理クラス - MCP-Management API対応・直接呼び出し設計"""
     
-    def __init__(self, mcp_management_url: str = "http://localhost:8008"):
+    def __init__(self, mcp_management_url: str = "http://localhost:8008", cache_ttl: float = 30.0):
         self.mcp_management_url = mcp_management_url
+        # ツール一覧キャッシュ（/tools, tools/list, tools/call ごとのHTTP取得を抑止）
+        self.cache_ttl = cache_ttl
+        self._tools_cache: Optional[List[Dict[str, Any]]] = None
+        self._tools_cache_time = 0.0
+        # 取得元リストから組み立てた派生形式のキャッシュ（名前 → (取得元リスト, 派生結果)）
+        self._derived_cache: Dict[str, Any] = {}
+        # 解決済みツール関数（ツール名 → 関数、モジュールのインポートと属性参照は初回のみ）
+        self._tool_functions: Dict[str, Callable] = {}
+    
+    def _get_derived(self, key: str, tools: List[Dict[str, Any]], build) -> Any:
+        """取得元リストが同一オブジェクトの間は派生形式を再構築しない"""
+        cached = self._derived_cache.get(key)
+        if cached is not None and cached[0] is tools:
+            return cached[1]
+        derived = build(tools)
+        self._derived_cache[key] = (tools, derived)
+        return derived
+    
+    def invalidate_cache(self) -> None:
+        """ツール一覧と派生形式のキャッシュを破棄（次回アクセス時に MCP-Management から再取得）"""
+        self._tools_cache = None
+        self._tools_cache_time = 0.0
+        self._derived_cache.clear()
     
     async def get_tools_from_management(self) -> List[Dict[str, Any]]:
-        """MCP-Management から CRM MCP のツール一覧を取得"""
+        """MCP-Management から CRM MCP のツール一覧を取得（TTLキャッシュ付き）"""
+        if self._tools_cache is not None and time.monotonic() - self._tools_cache_time < self.cache_ttl:
+            return self._tools_cache
+        
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.get(f"{self.mcp_management_url}/api/tools")
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"[ToolsManager] MCP-Management response: {data}")
-                    
-                    # レスポンス構造確認・修正
-                    if isinstance(data, list):
-                        # 直接リストの場合
-                        tools_list = data
-                    elif isinstance(data, dict) and "tools" in data:
-                        # {"tools": [...]} の場合
-                        tools_list = data["tools"]
-                    else:
-                        print(f"[ToolsManager] Unexpected response structure: {data}")
-                        return []
-                    
-                    # CRM MCP のツールのみ返す (enabled フィルタリング削除)
-                    crm_tools = [tool for tool in tools_list if tool.get("mcp_server_name") == "CRM MCP"]
-                    print(f"[ToolsManager] CRM MCP tools: {[tool.get('tool_key') for tool in crm_tools]}")
-                    return crm_tools
+            response = await get_http_client().get(f"{self.mcp_management_url}/api/tools", timeout=5.0)
+            if response.status_code == 200:
+                data = response.json()
+                logger.debug("[ToolsManager] MCP-Management response: %s", data)
+                
+                # レスポンス構造確認・修正
+                if isinstance(data, list):
+                    # 直接リストの場合
+                    tools_list = data
+                elif isinstance(data, dict) and "tools" in data:
+                    # {"tools": [...]} の場合
+                    tools_list = data["tools"]
                 else:
-                    print(f"[ToolsManager] MCP-Management API error: {response.status_code}")
+                    logger.error("[ToolsManager] Unexpected response structure: %s", data)
                     return []
+                
+                # CRM MCP のツールのみ返す (enabled フィルタリング削除)
+                # 同一 tool_key の重複定義は先頭のみ採用（tools/list の重複掲載を防ぐ）
+                unique_tools = {}
+                for tool in tools_list:
+                    if tool.get("mcp_server_name") == "CRM MCP":
+                        unique_tools.setdefault(tool.get("tool_key"), tool)
+                crm_tools = list(unique_tools.values())
+                logger.info("[ToolsManager] CRM MCP tools: %s", [tool.get("tool_key") for tool in crm_tools])
+                self._tools_cache = crm_tools
+                self._tools_cache_time = time.monotonic()
+                return crm_tools
+            else:
+                logger.error("[ToolsManager] MCP-Management API error: %s", response.status_code)
+                return []
         except Exception as e:
-            print(f"[ToolsManager] Failed to fetch tools from MCP-Management: {e}")
+            logger.error("[ToolsManager] Failed to fetch tools from MCP-Management: %s", e)
             return []
     
     async def get_tools_list(self) -> List[Dict[str, Any]]:
         """tools/list用のツール一覧"""
         tools = await self.get_tools_from_management()
-        
+        return self._get_derived("tools_list", tools, self._build_tools_list)
+    
+    @staticmethod
+    def _build_tools_list(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         return [
             {
                 "name": tool["tool_key"],  # tool_key をそのまま name として使用
@@ -63,7 +112,10 @@ class ToolsManager:
     async def get_tools_descriptions(self) -> List[Dict[str, Any]]:
         """/tools/descriptions用の詳細情報"""
         tools = await self.get_tools_from_management()
-        
+        return self._get_derived("tools_descriptions", tools, self._build_tools_descriptions)
+    
+    @staticmethod
+    def _build_tools_descriptions(tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         return [
             {
                 "name": tool["tool_key"],
@@ -79,6 +131,20 @@ class ToolsManager:
             for tool in tools
         ]
     
+    async def get_tools_list_json(self) -> bytes:
+        """/tools 用レスポンスボディ（ツール一覧の更新時のみ再シリアライズ）"""
+        tools = await self.get_tools_from_management()
+        return self._get_derived("tools_list_json", tools, lambda source: orjson.dumps({
+            "tools": self._get_derived("tools_list", source, self._build_tools_list)
+        }))
+    
+    async def get_tools_descriptions_json(self) -> bytes:
+        """/tools/descriptions 用レスポンスボディ（ツール一覧の更新時のみ再シリアライズ）"""
+        tools = await self.get_tools_from_management()
+        return self._get_derived("tools_descriptions_json", tools, lambda source: orjson.dumps({
+            "tools": self._get_derived("tools_descriptions", source, self._build_tools_descriptions)
+        }))
+    
     async def get_mcp_tools_format(self) -> List[Dict[str, Any]]:
         """MCPプロトコル用のツール一覧"""
         return await self.get_tools_descriptions()
@@ -87,32 +153,28 @@ class ToolsManager:
         """ツール名の有効性チェック"""
         tools = await self.get_tools_from_management()
         
-        print(f"[ToolsManager] is_valid_tool called with: {tool_name}")
-        print(f"[ToolsManager] Available tools: {[tool.get('tool_key') for tool in tools]}")
-        
-        result = any(tool["tool_key"] == tool_name for tool in tools)
-        print(f"[ToolsManager] is_valid_tool result: {result}")
+        # tool_key 集合は一覧の更新時のみ再構築（呼び出しごとの線形走査を避ける）
+        tool_keys = self._get_derived("tool_keys", tools, lambda source: frozenset(tool["tool_key"] for tool in source))
+        result = tool_name in tool_keys
+        logger.debug("[ToolsManager] is_valid_tool(%s): %s", tool_name, result)
         
         return result
     
     async def get_tool_function(self, tool_name: str):
-        """ツール名から関数を直接取得 - マッピングなし"""
-        # 直接インポート・呼び出し
-        if tool_name == "search_customers_by_bond_maturity":
-            from tools.bond_maturity import search_customers_by_bond_maturity
-            return search_customers_by_bond_maturity
-        elif tool_name == "get_customer_holdings":
-            from tools.customer_holdings import get_customer_holdings
-            return get_customer_holdings
-        elif tool_name == "predict_cash_inflow_from_sales_notes":
-            from tools.cash_inflow_prediction import predict_cash_inflow_from_sales_notes
-            return predict_cash_inflow_from_sales_notes
-        elif tool_name == "get_customers_by_product_text":
-            from tools.product_customers import get_customers_by_product_text
-            return get_customers_by_product_text
-        else:
-            print(f"[ToolsManager] Unknown tool: {tool_name}")
+        """ツール名から関数を取得（ディスパッチテーブル参照・モジュールは初回使用時にインポート）"""
+        tool_function = self._tool_functions.get(tool_name)
+        if tool_function is not None:
+            return tool_function
+        
+        entry = TOOL_FUNCTIONS.get(tool_name)
+        if entry is None:
+            logger.warning("[ToolsManager] Unknown tool: %s", tool_name)
             return None
+        
+        module_name, function_name = entry
+        tool_function = getattr(importlib.import_module(module_name), function_name)
+        self._tool_functions[tool_name] = tool_function
+        return tool_function
     
     async def get_tool_names(self) -> List[str]:
         """全ツール名のリスト"""
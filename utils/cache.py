@@ -0,0 +1,40 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# キャッシュ未登録を表す番兵（None を値として保持できるように）
+_MISSING = object()
+
+class TTLCache:
+    """件数上限付きのプロセス内TTLキャッシュ（上限超過時は最も古く参照されたものから破棄）"""
+    
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """有効期限内の値を返す（期限切れ・未登録は default）"""
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """値を登録（有効期限は登録時点から ttl 秒）"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def pop(self, key: Hashable) -> None:
+        """指定キーを破棄（未登録なら何もしない）"""
+        self._data.pop(key, None)
+    
+    def clear(self) -> None:
+        self._data.clear()
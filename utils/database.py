@@ -1,7 +1,63 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from config import DB_CONFIG
+import asyncpg
+from contextlib import asynccontextmanager
+from typing import Sequence, Tuple
+from config import get_db_config
 
-def get_db_connection():
-    """データベース接続を取得"""
-    return psycopg2.connect(**DB_CONFIG)
+# プロセス共通のコネクションプール（アプリ起動時に初期化）
+_pool = None
+
+def _make_connection_init(warmup_queries: Sequence[Tuple[str, tuple]]):
+    """新規接続ごとにウォームアップクエリを実行し、asyncpg のステートメントキャッシュに準備済み文を載せる"""
+    async def init(conn):
+        for query, args in warmup_queries:
+            await conn.fetch(query, *args)
+    return init
+
+async def init_db_pool(warmup_queries: Sequence[Tuple[str, tuple]] = ()):
+    """コネクションプールを初期化（min_size 本の接続を起動時に確立）
+    
+    warmup_queries: (SQL, 引数) の組。接続確立時に実行して parse/plan 済みにしておく
+    （0件になる引数を渡し、初回リクエストでの準備コストを起動時に前倒しする）
+    """
+    global _pool
+    if _pool is None:
+        db_config = get_db_config()
+        _pool = await asyncpg.create_pool(
+            host=db_config.host,
+            port=db_config.port,
+            database=db_config.database,
+            user=db_config.user,
+            password=db_config.password,
+            # 接続確立時に1度だけ適用するセッション設定（クエリごとのSET不要）
+            # 短いOLTPクエリではJITのコンパイル時間が実行時間を上回るため無効化
+            server_settings={
+                "jit": "off",
+                "statement_timeout": db_config.statement_timeout,
+                "application_name": "crm-mcp"
+            },
+            min_size=db_config.pool_min_size,
+            max_size=db_config.pool_max_size,
+            # 遊休接続は5分で閉じてサーバー側のバックエンドを解放
+            max_inactive_connection_lifetime=300,
+            # クライアント側のクエリタイムアウト（ネットワーク断で待ち続けない）
+            command_timeout=60,
+            statement_cache_size=db_config.statement_cache_size,
+            init=_make_connection_init(warmup_queries) if warmup_queries else None
+        )
+        # 起動時に疎通確認（初回リクエストで接続エラーを検知しないように）
+        await _pool.fetchval("SELECT 1")
+    return _pool
+
+async def close_db_pool():
+    """コネクションプールを破棄"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+@asynccontextmanager
+async def get_db_connection():
+    """プールからデータベース接続を取得し、終了時に返却"""
+    pool = _pool or await init_db_pool()
+    async with pool.acquire() as conn:
+        yield conn
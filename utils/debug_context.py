@@ -0,0 +1,13 @@
+"""
+Debug Context - ツール呼び出し単位のデバッグ出力設定
+"""
+
+from contextvars import ContextVar
+
+# 現在のツール呼び出しで debug_response にプロンプト全文・検索結果を含めるか
+# （call_tool がリクエストの params.debug に合わせて設定、タスクごとに独立）
+full_debug_var: ContextVar[bool] = ContextVar("full_debug", default=True)
+
+def is_full_debug() -> bool:
+    """debug_response の全文出力が必要か（False なら要約のみ返されるため大きな項目の組み立ては不要）"""
+    return full_debug_var.get()
@@ -0,0 +1,21 @@
+import httpx
+
+# プロセス共通の HTTP クライアント（キープアライブ接続を呼び出し間で再利用）
+_client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """共有 HTTP クライアントを返す（初回呼び出し時に生成、生成は同期処理のためロック不要）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+        )
+    return _client
+
+async def close_http_client():
+    """共有 HTTP クライアントを破棄"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
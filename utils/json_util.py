@@ -0,0 +1,38 @@
+"""
+JSON Utility - orjson ベースのシリアライズ
+"""
+
+from decimal import Decimal
+from typing import Any, Dict
+import orjson
+from starlette.responses import JSONResponse
+
+def json_default(obj: Any) -> Any:
+    """orjson が直接扱えない型の変換（Decimal → float、その他は文字列化）"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+def canonical_input(params: Dict[str, Any]) -> str:
+    """LLM標準化用の入力文字列（text_input があればそのまま、なければキー順固定のJSON）"""
+    text_input = params.get("text_input")
+    if isinstance(text_input, str):
+        return text_input
+    return orjson.dumps(params, default=json_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+
+# 偽として扱うフラグ文字列（大文字小文字・前後の空白は無視）
+_FALSE_FLAG_STRINGS = frozenset({"false", "0", "no", "off", "n", "f", ""})
+
+def to_flag(value: Any, default: bool) -> bool:
+    """JSON入力の真偽値フラグを正規化（未指定は default、False・0 と文字列 "false" "0" "no" "off" などは偽）"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() not in _FALSE_FLAG_STRINGS
+    return bool(value)
+
+class ORJSONResponse(JSONResponse):
+    """orjson でシリアライズするJSONレスポンス"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
@@ -3,13 +3,7 @@ LLM Client for CRM MCP
 Amazon Bedrock Claude 3 Sonnet を使用したLLM呼び出し
 """
 
-import boto3
-import json
-import asyncio
-from typing import Optional
-
-# Bedrock クライアント初期化
-bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
+from utils.llm_util import llm_util
 
 async def call_bedrock_llm(system_prompt: str, user_input: str) -> str:
     """
@@ -36,19 +30,8 @@ async def call_bedrock_llm(system_prompt: str, user_input: str) -> str:
             ]
         }
         
-        # 同期呼び出しを非同期で実行
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            lambda: bedrock_client.invoke_model(
-                modelId="anthropic.claude-3-sonnet-20240229-v1:0",
-                body=json.dumps(request_body),
-                contentType="application/json"
-            )
-        )
-        
-        # レスポンス解析
-        response_body = json.loads(response['body'].read())
+        # 共有クライアント・スレッド実行・レイテンシ設定は llm_util と共通
+        response_body = await llm_util.invoke_model(request_body)
         return response_body['content'][0]['text']
         
     except Exception as e:
@@ -4,25 +4,109 @@ LLM Utility - Bedrock Claude呼び出しユーティリティ
 このファイルは他のリポジトリにコピー可能な汎用LLMユーティリティです。
 """
 
-import json
+import orjson
+import asyncio
+import hashlib
 import time
 import logging
 import boto3
-from typing import Tuple
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Dict, Optional, Tuple
 from config import BEDROCK_CONFIG
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# 引数標準化（小さなJSONのみを返す呼び出し）用の出力トークン上限とモデル
+STANDARDIZE_MAX_TOKENS = 256
+STANDARDIZE_MODEL_ID = BEDROCK_CONFIG["standardize_model_id"]
+STANDARDIZE_LATENCY = BEDROCK_CONFIG["standardize_latency"]
+
+# Bedrock 同時呼び出し数の上限（接続プールとスレッド数を揃える）
+BEDROCK_MAX_CONCURRENCY = 50
+
+# Bedrock 呼び出し専用スレッドプール（既定のエグゼキューターを他の to_thread 利用と取り合わない）
+_bedrock_executor = ThreadPoolExecutor(max_workers=BEDROCK_MAX_CONCURRENCY, thread_name_prefix="bedrock")
+
+
+@lru_cache(maxsize=1)
+def get_bedrock_client():
+    """Bedrock Runtime クライアントを初回使用時に1度だけ生成して共有"""
+    return boto3.client(
+        'bedrock-runtime',
+        region_name=BEDROCK_CONFIG["region_name"],
+        # 並列スレッドからの同時呼び出しで接続待ちにならないようプールを拡大
+        # 遊休接続は TCP キープアライブで維持し、接続確立の失敗は早めに打ち切る
+        # （読み取りタイムアウトは長い整形応答を考慮し既定の60秒のまま）
+        config=Config(max_pool_connections=BEDROCK_MAX_CONCURRENCY, retries={"max_attempts": 2, "mode": "standard"},
+                      tcp_keepalive=True, connect_timeout=5)
+    )
+
 
 class LLMUtil:
     """LLM呼び出しユーティリティクラス"""
     
     def __init__(self, bedrock_client=None, model_id: str = None):
-        if bedrock_client is None:
-            self.bedrock_client = boto3.client('bedrock-runtime', region_name=BEDROCK_CONFIG["region_name"])
-        else:
-            self.bedrock_client = bedrock_client
+        # 未指定の場合は共有クライアントを初回呼び出し時に生成（import 時に生成しない）
+        self._bedrock_client = bedrock_client
         self.model_id = model_id or BEDROCK_CONFIG["model_id"]
+        # 応答キャッシュ（リクエストボディのハッシュ単位、ttl 0 なら無効）
+        ttl = BEDROCK_CONFIG["response_cache_ttl"]
+        self._response_cache = TTLCache(ttl=ttl, maxsize=512) if ttl > 0 else None
+        # 実行中の呼び出し（同一リクエストの同時呼び出しは1回の API 呼び出しを共有）
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+    
+    @property
+    def bedrock_client(self):
+        if self._bedrock_client is None:
+            self._bedrock_client = get_bedrock_client()
+        return self._bedrock_client
+    
+    def _system_field(self, system_prompt: str):
+        """プロンプトキャッシュ有効時は system をキャッシュ指定付きブロックで渡す"""
+        if not BEDROCK_CONFIG["prompt_caching"]:
+            return system_prompt
+        return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+    
+    async def invoke_model(self, body: dict, model_id: Optional[str] = None, latency: Optional[str] = None) -> dict:
+        """invoke_model を実行し、レスポンスボディを辞書で返す（model_id・latency 未指定時は既定値）"""
+        kwargs = {"modelId": model_id or self.model_id, "body": orjson.dumps(body)}
+        latency = latency or BEDROCK_CONFIG["latency"]
+        if latency != "standard":
+            kwargs["performanceConfigLatency"] = latency
+        
+        # 同一モデル・同一ボディの応答は再利用（大きなプロンプトを保持しないようハッシュをキーにする）
+        cache_key = hashlib.sha256(kwargs["modelId"].encode() + b"\0" + kwargs["body"]).digest()
+        if self._response_cache is not None:
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        # 同一リクエストが実行中ならその結果を待つ（呼び出し元のキャンセルは共有タスクに波及させない）
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self._invoke_uncached(kwargs, cache_key))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return await asyncio.shield(task)
+    
+    async def _invoke_uncached(self, kwargs: dict, cache_key: bytes) -> dict:
+        """Bedrock を実際に呼び出し、成功した応答をキャッシュに登録"""
+        # 同期APIのため専用スレッドプールで実行（イベントループをブロックしない）
+        response = await asyncio.get_running_loop().run_in_executor(
+            _bedrock_executor, partial(self.bedrock_client.invoke_model, **kwargs)
+        )
+        response_body = orjson.loads(response['body'].read())
+        if BEDROCK_CONFIG["prompt_caching"]:
+            # プロンプトキャッシュの効果確認用（読み出し・書き込みトークン数）
+            usage = response_body.get("usage", {})
+            logger.debug("[LLMUtil] Prompt cache usage: read=%s write=%s",
+                         usage.get("cache_read_input_tokens"), usage.get("cache_creation_input_tokens"))
+        if self._response_cache is not None:
+            self._response_cache.set(cache_key, response_body)
+        return response_body
     
     async def call_claude_with_llm_info(self, system_prompt: str, user_message: str, 
                                       max_tokens: int = 4000, temperature: float = 0.1) -> Tuple[str, str, str, float]:
@@ -58,7 +142,8 @@ class LLMUtil:
             return error_response, full_prompt, error_response, execution_time
     
     async def call_claude(self, system_prompt: str, user_message: str, 
-                         max_tokens: int = 1000, temperature: float = 0.1) -> str:
+                         max_tokens: int = 1000, temperature: float = 0.1,
+                         model_id: Optional[str] = None, latency: Optional[str] = None) -> str:
         """
         Claude API呼び出し（基本）
         
@@ -67,6 +152,8 @@ class LLMUtil:
             user_message: ユーザーメッセージ
             max_tokens: 最大トークン数
             temperature: 温度パラメータ
+            model_id: 使用するモデルID（未指定時は既定モデル）
+            latency: 推論レイテンシ設定（"standard" / "optimized"、未指定時は BEDROCK_LATENCY）
             
         Returns:
             Claude応答文字列
@@ -81,7 +168,7 @@ class LLMUtil:
             body = {
                 "anthropic_version": "bedrock-2023-05-31",
                 "max_tokens": max_tokens,
-                "system": system_prompt,
+                "system": self._system_field(system_prompt),
                 "messages": [
                     {
                         "role": "user",
@@ -91,20 +178,59 @@ class LLMUtil:
                 "temperature": temperature
             }
             
-            response = self.bedrock_client.invoke_model(
-                modelId=self.model_id,
-                body=json.dumps(body)
-            )
-            
-            response_body = json.loads(response['body'].read())
+            response_body = await self.invoke_model(body, model_id, latency)
             return response_body['content'][0]['text']
             
         except Exception as e:
-            logger.error(f"Claude API call failed: {e}")
-            print(f"[ERROR] Bedrock call failed: {e}")
+            logger.error("[LLMUtil] Claude API call failed: %s", e)
             return f"LLMエラー: {str(e)}"
     
-    async def call_llm_simple(self, full_prompt: str, max_tokens: int = 1000, temperature: float = 0.1) -> Tuple[str, float]:
+    async def call_claude_tool(self, system_prompt: str, user_message: str, tool: Dict[str, Any],
+                               max_tokens: int = 1000, temperature: float = 0.1,
+                               model_id: Optional[str] = None, latency: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Claude API呼び出し（ツール指定による構造化出力）
+        
+        Args:
+            system_prompt: システムプロンプト
+            user_message: ユーザーメッセージ
+            tool: ツール定義（name, description, input_schema）。必ずこのツールを呼ばせる
+            max_tokens: 最大トークン数
+            temperature: 温度パラメータ
+            model_id: 使用するモデルID（未指定時は既定モデル）
+            latency: 推論レイテンシ設定（"standard" / "optimized"、未指定時は BEDROCK_LATENCY）
+            
+        Returns:
+            input_schema に沿ったツール入力の辞書（応答テキストのJSON解析は不要）
+        """
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "system": self._system_field(system_prompt),
+            "messages": [
+                {
+                    "role": "user",
+                    "content": user_message
+                }
+            ],
+            "tools": [tool],
+            "tool_choice": {"type": "tool", "name": tool["name"]},
+            "temperature": temperature
+        }
+        
+        try:
+            response_body = await self.invoke_model(body, model_id, latency)
+        except Exception as e:
+            logger.error("[LLMUtil] Claude tool call failed: %s", e)
+            raise
+        
+        for block in response_body['content']:
+            if block.get("type") == "tool_use":
+                return block["input"]
+        raise ValueError(f"ツール呼び出し結果が応答に含まれていません (tool: {tool['name']})")
+    
+    async def call_llm_simple(self, full_prompt: str, max_tokens: int = 1000, temperature: float = 0.1,
+                              model_id: Optional[str] = None, latency: Optional[str] = None) -> Tuple[str, float]:
         """純粋なLLM呼び出し - 完全なプロンプトを受け取りレスポンスを返す"""
         start_time = time.time()
         
@@ -117,20 +243,14 @@ class LLMUtil:
                 "temperature": temperature
             }
             
-            response = self.bedrock_client.invoke_model(
-                modelId=self.model_id,
-                body=json.dumps(body)
-            )
-            
-            response_body = json.loads(response['body'].read())
+            response_body = await self.invoke_model(body, model_id, latency)
             execution_time = (time.time() - start_time) * 1000
             
             return response_body['content'][0]['text'], execution_time
             
         except Exception as e:
             execution_time = (time.time() - start_time) * 1000
-            logger.error(f"LLM call error: {e}")
-            print(f"[ERROR] LLM call failed: {e}")
+            logger.error("[LLMUtil] LLM call failed: %s", e)
             return f"LLMエラー: {str(e)}", execution_time
 
 # グローバルインスタンス（後方互換性）
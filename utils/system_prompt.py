@@ -1,24 +1,44 @@
-import httpx
+import logging
+from typing import Optional
+from utils.cache import TTLCache
+from utils.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# 取得済みプロンプトのキャッシュ（プロンプト更新は /admin/prompts/invalidate で即時反映）
+_prompt_cache = TTLCache(ttl=300.0, maxsize=64)
+
+def clear_system_prompt_cache(prompt_key: Optional[str] = None) -> None:
+    """プロンプトキャッシュを破棄（prompt_key 指定時はそのキーのみ、次回取得時にAPIから再取得）"""
+    if prompt_key is None:
+        _prompt_cache.clear()
+    else:
+        _prompt_cache.pop(prompt_key)
 
 async def get_system_prompt(prompt_key: str) -> str:
-    """SystemPrompt Management APIからプロンプト取得"""
+    """SystemPrompt Management APIからプロンプト取得（5分間キャッシュ）"""
+    cached = _prompt_cache.get(prompt_key)
+    if cached is not None:
+        return cached
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"http://localhost:8002/api/system-prompts/{prompt_key}",
-                timeout=10.0
-            )
+        response = await get_http_client().get(
+            f"http://localhost:8002/api/system-prompts/{prompt_key}",
+            timeout=10.0
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            logger.debug("[get_system_prompt] SUCCESS: Found prompt for key: %s", prompt_key)
+            # 取得成功時のみキャッシュ（エラーメッセージは保持しない）
+            _prompt_cache.set(prompt_key, data["prompt_text"])
+            return data["prompt_text"]
+        else:
+            error_msg = f"システムプロンプトが取得できませんでした (key: {prompt_key}, status: {response.status_code})"
+            logger.error("[get_system_prompt] ERROR: %s", error_msg)
+            return error_msg
             
-            if response.status_code == 200:
-                data = response.json()
-                print(f"[get_system_prompt] SUCCESS: Found prompt for key: {prompt_key}")
-                return data["prompt_text"]
-            else:
-                error_msg = f"システムプロンプトが取得できませんでした (key: {prompt_key}, status: {response.status_code})"
-                print(f"[get_system_prompt] ERROR: {error_msg}")
-                return error_msg
-                
     except Exception as e:
         error_msg = f"システムプロンプトが取得できませんでした (key: {prompt_key}, error: {str(e)})"
-        print(f"[get_system_prompt] EXCEPTION: {error_msg}")
+        logger.error("[get_system_prompt] EXCEPTION: %s", error_msg)
         return error_msg